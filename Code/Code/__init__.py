@@ -0,0 +1,4 @@
+"""
+Simulation, post-processing and report flow of the HW2 amplifier. The
+modules import PyLTSpice, pandas and matplotlib only where they are used.
+"""
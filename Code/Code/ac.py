@@ -1,100 +1,114 @@
-import pandas as pd
 import os
-import io
-import re
 import numpy as np
-import subprocess
-import shutil
-import ltspice
-import matplotlib.pyplot as plt
-import scienceplots
-from PyLTSpice import SimRunner
-from PyLTSpice import SpiceEditor
-from PyLTSpice import RawRead
-from matplotlib.ticker import EngFormatter
-
-from src.ltspice_to_svg import main as lt_to_svg
-plt.style.use(['science','ieee', 'no-latex'])
-
+from .cache import run_cached
+from .context import default_context
+from .netlist import load_netlist
+from .simulator import get_runner
+from .rawfile import read_raw
+from .figures import figure
+from .trace import traced
 
 dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
-def read_ac_closed(filename):
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_ac.raw"))
+ac_instructions = (
+    "; Simulation settings",
+    ".ac dec 10 1 100G",
+)
+
+# Points per decade of the follow-up sweeps of the adaptive AC mode
+refine_points = 1000
+# Loop-gain phase at which the gain margin is read (the phase crossover,
+# where the phase margin reaches zero), as in open_loop_metrics
+gm_phase = -np.pi
+
+def _at(f, values, index):
+    return np.take_along_axis(np.broadcast_to(f, np.shape(values)), index[..., None], axis=-1)[..., 0]
+
+def closed_loop_metrics(f, A_dB):
+    """
+    -3 dB bandwidth in Hz and the matching time constant in us, along the last
+    axis of A_dB.
+    """
+    A_3dB = np.max(A_dB, axis=-1, keepdims=True) - 3
+    f_3dB = _at(f, A_dB, np.argmin(np.abs(A_dB - A_3dB), axis=-1))
+    tau_cl=1/(2 * np.pi * f_3dB)*1e6
+    return f_3dB, tau_cl
+
+def open_loop_metrics(f, Vip_dB, Vip_phase):
+    """
+    Unity-gain frequency, phase margin, gain margin and the gain-margin
+    frequency of the loop gain, along the last axis.
+    """
+    zero_index = np.argmin(np.abs(Vip_dB), axis=-1)
+    BW_ol = _at(f, Vip_dB, zero_index)
+    PM = np.take_along_axis(Vip_phase, zero_index[..., None], axis=-1)[..., 0] + np.pi
+
+    fully_real_index = np.argmin(np.abs(Vip_phase - gm_phase), axis=-1)
+    GM = -np.take_along_axis(Vip_dB, fully_real_index[..., None], axis=-1)[..., 0]
+    f_GM = _at(f, Vip_dB, fully_real_index)
+    return BW_ol, PM, GM, f_GM
+
+@traced("read")
+def read_ac_closed(filename, ctx=None, render=True):
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_ac.raw"), traces=["V(Vo)"])
     
     f = np.abs(LTR.get_axis())
     Vo = LTR.get_trace("V(Vo)")
     Vo_dB = 20*np.log10(np.abs(Vo))
     Vo_phase = np.unwrap(np.angle(Vo))
 
-    fig,ax = plt.subplots(figsize=(7,4))
-    ax.plot(f,Vo_dB, label="$V_o$ [dB]")
-    axtwin = ax.twinx()
-    axtwin.plot(f,Vo_phase, label="V_o [rad]", color="C1")
-    plt.xscale('log')
-
-    ax.set_xlabel("Frequency")
-    ax.set_ylabel("Magnitude [dB]")
-    axtwin.set_ylabel("Phase [rad]")
-
-    formatter0=EngFormatter(unit='Hz')
-    ax.xaxis.set_major_formatter(formatter0)
-
-
-    # LABELS
     A_max = np.max(Vo_dB)
-    A_3dB = A_max - 3
-    f_3dB = f[np.argmin(np.abs(Vo_dB - A_3dB))]
-    A_bot = np.min(Vo_dB)-5
+    f_3dB, tau_cl = closed_loop_metrics(f, Vo_dB)
 
     print(A_max)
 
-    tau_cl=1/(2 * np.pi * f_3dB)*1e6
-
-    ax.vlines(f_3dB, ymax=A_max, ymin = A_bot)
-    ax.annotate(rf"$BW_{{cl}}={f_3dB*1e-6:.3f} MHz$", (f_3dB*0.8, A_bot), ha='right')
-    ax.annotate(rf"$\tau={tau_cl:.3f} \mu s$", (f_3dB*1.2, A_bot), ha='left')
-
-    ax.set_ylim(ymin=A_bot-4)
-    plt.legend()
-    plt.tight_layout()
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_ac.pdf"), transparent = True)
+    if render:
+        figure(render, "bode", [ctx.fig(rf"{filename}_ac.pdf")], f=f, A_dB=Vo_dB, A_phase=Vo_phase, f_3dB=f_3dB, tau_cl=tau_cl)
 
     return f_3dB, tau_cl
 
 
-def write_ac_closed(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1):
-    LTC = SimRunner(output_folder=os.path.join(dir_path, "Simulations"))
-    LTC.create_netlist(os.path.join(dir_path, "Circuits", rf"{filename}.asc"))
-    netlist = SpiceEditor(os.path.join(dir_path, "Circuits", rf"{filename}.net"))
+@traced("write")
+def write_ac_closed(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, LTC=None, ctx=None):
+    ctx = ctx or default_context
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist = load_netlist(ctx.circuit(rf"{filename}.asc"), LTC, corner=ctx.corner)
 
     netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
 
-    netlist.add_instructions(
-    "; Simulation settings",
-    ".ac dec 10 1 100G",
-    )
+    netlist.add_instructions(*ac_instructions)
     
-    LTC.run(netlist, run_filename="closed_loop_ac")
-    LTC.wait_completion(2)
-
-def write_ac_open(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, load="unloaded"):
-    LTC = SimRunner(output_folder=os.path.join(dir_path, "Simulations"))
-    LTC.create_netlist(os.path.join(dir_path, "Circuits", rf"{filename}_{load}.asc"))
-    netlist = SpiceEditor(os.path.join(dir_path, "Circuits", rf"{filename}_{load}.net"))
+    cached = run_cached(LTC, netlist, "closed_loop_ac")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
+
+@traced("write")
+def write_ac_open(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, load="unloaded", LTC=None, ctx=None):
+    ctx = ctx or default_context
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist = load_netlist(ctx.circuit(rf"{filename}_{load}.asc"), LTC, corner=ctx.corner)
 
     netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
 
-    netlist.add_instructions(
-    "; Simulation settings",
-    ".ac dec 10 1 100G",
-    )
+    netlist.add_instructions(*ac_instructions)
     
-    LTC.run(netlist, run_filename=rf"{filename}_{load}_ac")
-    LTC.wait_completion(2)
-
-def closed_loop_from_open(filename, load="loaded"):
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_{load}_ac.raw"))
+    cached = run_cached(LTC, netlist, rf"{filename}_{load}_ac")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
+
+def closed_loop_response(filename, load="loaded", ctx=None):
+    """
+    Complex closed-loop gain A_CL derived from the open-loop AC run.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_{load}_ac.raw"), traces=["V(Vo)", "V(Vinp)"])
     
     f = np.abs(LTR.get_axis())
     Vo = LTR.get_trace("V(Vo)").get_wave()
@@ -102,45 +116,28 @@ def closed_loop_from_open(filename, load="loaded"):
     
     A_CL = (Vip) / (1 + Vip) * (Vo/Vip-1)
     # A_CL = 1/(1+Vip)
+    return f, A_CL
+
+@traced("read")
+def closed_loop_from_open(filename, load="loaded", ctx=None, render=True):
+    ctx = ctx or default_context
+    f, A_CL = closed_loop_response(filename, load=load, ctx=ctx)
     A_dB = 20*np.log10(np.abs(A_CL))
     A_phase = np.unwrap(np.angle(A_CL))
 
-    fig,ax = plt.subplots(figsize=(7,4))
-    ax.plot(f,A_dB, label="$V_o$ [dB]")
-    axtwin = ax.twinx()
-    axtwin.plot(f,A_phase, label="V_o [rad]", color="C1")
-    plt.xscale('log')
-
-    ax.set_xlabel("Frequency")
-    ax.set_ylabel("Magnitude [dB]")
-    axtwin.set_ylabel("Phase [rad]")
-
-    formatter0=EngFormatter(unit='Hz')
-    ax.xaxis.set_major_formatter(formatter0)
-
-
-    # LABELS
     A_max = np.max(A_dB)
-    A_3dB = A_max - 3
-    f_3dB = f[np.argmin(np.abs(A_dB - A_3dB))]
-    A_bot = np.min(A_dB)-5
+    f_3dB, tau_cl = closed_loop_metrics(f, A_dB)
 
     print(A_max)
 
-    tau_cl=1/(2 * np.pi * f_3dB)*1e6
-
-    ax.vlines(f_3dB, ymax=A_max, ymin = A_bot)
-    ax.annotate(rf"$BW_{{cl}}={f_3dB*1e-6:.3f} MHz$", (f_3dB*0.8, A_bot), ha='right')
-    ax.annotate(rf"$\tau={tau_cl:.3f} \mu s$", (f_3dB*1.2, A_bot), ha='left')
-
-    ax.set_ylim(ymin=A_bot-4)
-    plt.legend()
-    plt.tight_layout()
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_ac_closed_from_open.pdf"), transparent = True)
+    if render:
+        figure(render, "bode", [ctx.fig(rf"{filename}_ac_closed_from_open.pdf")], f=f, A_dB=A_dB, A_phase=A_phase, f_3dB=f_3dB, tau_cl=tau_cl)
 
 
-def read_ac_open(filename, load="unloaded"):
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_{load}_ac.raw"))
+@traced("read")
+def read_ac_open(filename, load="unloaded", ctx=None, render=True):
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_{load}_ac.raw"), traces=["V(Vo)", "V(Vinp)"])
     
     f = np.abs(LTR.get_axis())
     Vo = LTR.get_trace("V(Vo)")
@@ -150,74 +147,139 @@ def read_ac_open(filename, load="unloaded"):
     Vip_dB = 20*np.log10(np.abs(Vip))
     Vip_phase = np.unwrap(np.angle(Vip))
 
-    fig,ax = plt.subplots(figsize=(7,4))
-    ax.plot(f,Vo_dB, "-", label="A [dB]", color="C0")
-    ax.plot(f, Vip_dB, "-", label=r"A$\beta$ [dB]", color="C1")
-    axtwin = ax.twinx()
-    axtwin.plot(f,Vo_phase, "--", label="A [rad]", color="C0")
-    axtwin.plot(f,Vip_phase, "--", label=r"A$\beta$ [rad]", color="C1")
-    plt.xscale('log')
-
-    ax.set_xlabel("Frequency")
-    ax.set_ylabel("Magnitude [dB]")
-    axtwin.set_ylabel("Phase [rad]")
-
-    formatter0=EngFormatter(unit='Hz')
-    ax.xaxis.set_major_formatter(formatter0)
-
-
-    # LABELS
-    zero_index = np.argmin(np.abs(Vip_dB))
-    BW_ol = f[zero_index]
-    PM = Vip_phase[zero_index]+np.pi
-
-    fully_real_index = np.argmin(np.abs(Vip_phase+np.pi/2))
-    GM = -Vip_dB[fully_real_index]
-    f_GM = f[fully_real_index]
-
-
+    BW_ol, PM, GM, f_GM = open_loop_metrics(f, Vip_dB, Vip_phase)
     tau_cl=1/(2 * np.pi * BW_ol)*1e6
 
-    # BW
-    A_bot = np.min(Vip_dB)-5
-    ax.vlines(BW_ol, ymax=0, ymin = A_bot)
-    ax.annotate(rf"$BW_{{cl}}={BW_ol*1e-6:.3f} MHz$", (BW_ol*0.8, A_bot), ha='right')
-    ax.annotate(rf"$\tau={tau_cl:.3f} \mu s$", (BW_ol*1.2, A_bot), ha='left')
-
-    # Margins 
-    axtwin.annotate(
-        '',                      
-        xy=(BW_ol, -np.pi + PM),      
-        xytext=(BW_ol, -np.pi), 
-        arrowprops=dict(arrowstyle="<->")
-    )
-    axtwin.annotate(
-        rf'PM={PM:.2f}',
-        xy = (BW_ol*0.9, -np.pi + 0.5 * PM),
-        ha='right',
-        va='center'
-    )
-    
-    ax.annotate(
-        '',                      
-        xy=(f_GM, 0),      
-        xytext=(f_GM, -GM), 
-        arrowprops=dict(arrowstyle="<->")
-    )
-    ax.annotate(
-        rf'GM={GM:.2f}',
-        xy = (f_GM*1.1, -0.5 * GM),
-        ha='left',
-        va='center'
-    )
-
-    ax.set_ylim(ymin=A_bot-4)
-    ax.grid()
-    plt.legend()
-    plt.tight_layout()
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_{load}_ac.pdf"), transparent = True)
+    if render:
+        figure(render, "loop_gain", [ctx.fig(rf"{filename}_{load}_ac.pdf")], f=f, Vo_dB=Vo_dB, Vo_phase=Vo_phase,
+               Vip_dB=Vip_dB, Vip_phase=Vip_phase, BW_ol=BW_ol, PM=PM, GM=GM, f_GM=f_GM, tau_cl=tau_cl)
 
     return BW_ol
 
-closed_loop_from_open("closed_loop")
-read_ac_closed("closed_loop")
\ No newline at end of file
+def _bracket(f, values, target):
+    """
+    First interval of the sweep in which values crosses target, or None.
+    """
+    d = np.sign(values - target)
+    index = np.flatnonzero(d[:-1] != d[1:])
+    if len(index) == 0:
+        return None
+    return f[index[0]], f[index[0] + 1]
+
+def _root(f, values, target):
+    # First crossing of target, interpolated on a log frequency axis
+    d = values - target
+    index = np.flatnonzero(np.sign(d[:-1]) != np.sign(d[1:]))
+    if len(index) == 0:
+        return np.nan
+    i = index[0]
+    x = np.log10(f)
+    return 10**(x[i] - d[i] * (x[i+1] - x[i]) / (d[i+1] - d[i]))
+
+def _value_at(f, values, f0):
+    return np.interp(np.log10(f0), np.log10(f), values)
+
+def _align_phase(f, phase, f_coarse, phase_coarse):
+    # The unwrapped phase of a narrow sweep starts on an arbitrary branch
+    reference = _value_at(f_coarse, phase_coarse, f[0])
+    return phase + 2*np.pi*np.round((reference - phase[0]) / (2*np.pi))
+
+def _refine(circuit, run_filename, brackets, parameters, traces, ctx, simulate=True):
+    """
+    Runs one dense .ac sweep inside each bracket, all on one runner, and
+    returns the loaded raw files by bracket name. Without simulate the raw
+    files of an earlier refinement are read; brackets without one are left out.
+    """
+    if simulate:
+        LTC = get_runner(ctx.sim_dir, parallel_sims=len(brackets))
+        for name, (f_lo, f_hi) in brackets.items():
+            netlist = load_netlist(ctx.circuit(rf"{circuit}.asc"), LTC, corner=ctx.corner)
+            netlist.set_parameters(**parameters)
+            netlist.add_instructions("; Simulation settings", rf".ac dec {refine_points} {f_lo:.6g} {f_hi:.6g}")
+            run_cached(LTC, netlist, rf"{run_filename}_{name}")
+        # The raw files are read right away, so every sweep has to be finished
+        LTC.wait_completion()
+
+    fine = {}
+    for name in brackets:
+        try:
+            fine[name] = read_raw(ctx.sim(rf"{run_filename}_{name}.raw"), traces=traces)
+        except FileNotFoundError:
+            continue
+    return fine
+
+@traced("simulate")
+def refine_ac_closed(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, simulate=True, ctx=None):
+    """
+    Adaptive AC mode of read_ac_closed: brackets the -3 dB point on the coarse
+    sweep written by write_ac_closed and solves for it on a dense follow-up
+    sweep inside the bracket. Without simulate an earlier follow-up sweep is
+    read, if there is one.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim("closed_loop_ac.raw"), traces=["V(Vo)"])
+    f = np.abs(LTR.get_axis())
+    Vo_dB = 20*np.log10(np.abs(LTR.get_trace("V(Vo)")))
+    A_3dB = np.max(Vo_dB) - 3
+
+    bracket = _bracket(f, Vo_dB, A_3dB)
+    if bracket is None:
+        f_3dB, tau_cl = closed_loop_metrics(f, Vo_dB)
+        return f_3dB, tau_cl
+
+    parameters = dict(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
+    fine = _refine(filename, "closed_loop_ac", {"3dB": bracket}, parameters, ["V(Vo)"], ctx, simulate=simulate)
+    if "3dB" not in fine:
+        f_3dB, tau_cl = closed_loop_metrics(f, Vo_dB)
+        return f_3dB, tau_cl
+    LTR = fine["3dB"]
+    f_fine = np.abs(LTR.get_axis())
+    f_3dB = _root(f_fine, 20*np.log10(np.abs(LTR.get_trace("V(Vo)"))), A_3dB)
+    if np.isnan(f_3dB):
+        f_3dB, tau_cl = closed_loop_metrics(f, Vo_dB)
+        return f_3dB, tau_cl
+    tau_cl=1/(2 * np.pi * f_3dB)*1e6
+    return f_3dB, tau_cl
+
+@traced("simulate")
+def refine_ac_open(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, load="loaded", simulate=True, ctx=None):
+    """
+    Adaptive AC mode of read_ac_open: brackets the 0 dB crossing and the
+    gain-margin phase crossing of the loop gain on the coarse sweep and solves
+    for BW_ol, PM, GM and f_GM on dense follow-up sweeps inside the brackets.
+    Without simulate earlier follow-up sweeps are read, if there are any.
+    """
+    ctx = ctx or default_context
+    run_filename = rf"{filename}_{load}_ac"
+    LTR = read_raw(ctx.sim(rf"{run_filename}.raw"), traces=["V(Vinp)"])
+    f = np.abs(LTR.get_axis())
+    Vip = LTR.get_trace("V(Vinp)")
+    Vip_dB = 20*np.log10(np.abs(Vip))
+    Vip_phase = np.unwrap(np.angle(Vip))
+    BW_ol, PM, GM, f_GM = open_loop_metrics(f, Vip_dB, Vip_phase)
+
+    brackets = {"0dB": _bracket(f, Vip_dB, 0), "gm": _bracket(f, Vip_phase, gm_phase)}
+    brackets = {name: bracket for name, bracket in brackets.items() if bracket is not None}
+    if not brackets:
+        return BW_ol, PM, GM, f_GM
+
+    parameters = dict(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
+    fine = _refine(rf"{filename}_{load}", run_filename, brackets, parameters, ["V(Vinp)"], ctx, simulate=simulate)
+
+    if "0dB" in fine:
+        f_fine = np.abs(fine["0dB"].get_axis())
+        Vip = fine["0dB"].get_trace("V(Vinp)")
+        root = _root(f_fine, 20*np.log10(np.abs(Vip)), 0)
+        if not np.isnan(root):
+            phase = _align_phase(f_fine, np.unwrap(np.angle(Vip)), f, Vip_phase)
+            BW_ol = root
+            PM = _value_at(f_fine, phase, BW_ol) + np.pi
+    if "gm" in fine:
+        f_fine = np.abs(fine["gm"].get_axis())
+        Vip = fine["gm"].get_trace("V(Vinp)")
+        phase = _align_phase(f_fine, np.unwrap(np.angle(Vip)), f, Vip_phase)
+        root = _root(f_fine, phase, gm_phase)
+        if not np.isnan(root):
+            f_GM = root
+            GM = -_value_at(f_fine, 20*np.log10(np.abs(Vip)), f_GM)
+    return BW_ol, PM, GM, f_GM
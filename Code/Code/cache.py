@@ -0,0 +1,119 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+from functools import partial
+
+from .rawfile import forget
+
+dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+cache_dir = os.path.join(dir_path, "Simulations", "cache")
+max_cache_size = 2 * 1024**3 # bytes
+enabled = os.environ.get("HW2_SIM_CACHE", "1") != "0"
+
+_lock = threading.Lock()
+
+def netlist_text(netlist):
+    # SpiceEditor only exposes its contents through save_netlist
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "netlist.net")
+        netlist.save_netlist(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+def decode_netlist(text):
+    # LTspice writes netlists as UTF-16 (with a BOM) or as plain 8-bit text
+    return text.decode("utf-16") if text[:2] in (b"\xff\xfe", b"\xfe\xff") else text.decode("latin-1")
+
+def netlist_key(text):
+    """
+    Hash of the netlist text (parameters and analysis directives included) and of
+    the contents of every model library it references.
+    """
+    h = hashlib.sha256(text)
+    for lib in sorted(set(re.findall(r"^\.lib\s+'?([^'\r\n]+?)'?(?:\s+\w+)?\s*$", decode_netlist(text), flags=re.M | re.I))):
+        if os.path.isfile(lib):
+            with open(lib, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        else:
+            h.update(lib.encode())
+    return h.hexdigest()
+
+def _entry(key, ext):
+    return os.path.join(cache_dir, rf"{key}.{ext}")
+
+def lookup(key, output_folder, run_filename):
+    """
+    Copies a cached raw/log pair to the output folder under run_filename.
+    Returns True on a hit.
+    """
+    raw, log = _entry(key, "raw"), _entry(key, "log")
+    with _lock:
+        if not (os.path.isfile(raw) and os.path.isfile(log)):
+            return False
+        shutil.copyfile(raw, os.path.join(output_folder, rf"{run_filename}.raw"))
+        shutil.copyfile(log, os.path.join(output_folder, rf"{run_filename}.log"))
+        # mtime doubles as the LRU timestamp
+        os.utime(raw)
+        os.utime(log)
+    return True
+
+def store(key, raw_file, log_file):
+    with _lock:
+        os.makedirs(cache_dir, exist_ok=True)
+        for src, ext in [(raw_file, "raw"), (log_file, "log")]:
+            if src is not None and os.path.isfile(src):
+                tmp = _entry(key, rf"{ext}.tmp")
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, _entry(key, ext))
+        evict()
+    return raw_file, log_file
+
+def evict(max_size=None):
+    max_size = max_cache_size if max_size is None else max_size
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = {}
+    for name in os.listdir(cache_dir):
+        key, ext = os.path.splitext(name)
+        if ext not in (".raw", ".log"):
+            continue
+        stat = os.stat(os.path.join(cache_dir, name))
+        size, mtime = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+    total = sum(size for size, _ in entries.values())
+    for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= max_size:
+            break
+        for ext in ("raw", "log"):
+            if os.path.isfile(_entry(key, ext)):
+                os.remove(_entry(key, ext))
+        total -= size
+
+def clear():
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def run_cached(LTC, netlist, run_filename):
+    """
+    Runs the netlist on LTC unless an identical netlist was simulated before, in
+    which case the cached raw/log files are restored and no simulation is started.
+    Returns True on a cache hit.
+    """
+    # The raw file is about to be replaced, a mapped copy would block that
+    forget(os.path.join(LTC.output_folder, rf"{run_filename}.raw"))
+    if not enabled or getattr(LTC, "in_memory", False):
+        LTC.run(netlist, run_filename=run_filename)
+        return False
+
+    key = netlist_key(netlist_text(netlist))
+    if lookup(key, LTC.output_folder, run_filename):
+        print(rf"Cache hit for {run_filename}")
+        return True
+
+    LTC.run(netlist, run_filename=run_filename, callback=partial(store, key))
+    return False
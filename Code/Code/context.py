@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+from .rawfile import forget
+
+dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Supply voltage the schematics are drawn with
+nominal_vdd = 1.8
+
+class RunContext:
+    """
+    Directories a single evaluation writes its netlists, raw files, logs,
+    processed tables and figures to.
+
+    Without a root a unique scratch directory is created under
+    Simulations/runs. On close the directory is deleted ("delete"), zipped
+    into Simulations/archive and deleted ("archive") or left alone ("keep").
+    corner is the corners.Corner the netlists are simulated at, None for the
+    schematic as drawn.
+    """
+    def __init__(self, root=None, cleanup="delete", name=None, corner=None):
+        if cleanup not in ("delete", "archive", "keep"):
+            raise ValueError(rf"Unknown cleanup mode {cleanup}")
+
+        if root is None:
+            runs = os.path.join(dir_path, "Simulations", "runs")
+            os.makedirs(runs, exist_ok=True)
+            root = tempfile.mkdtemp(prefix=rf"{name or 'run'}_", dir=runs)
+        self.root = root
+        self.cleanup = cleanup
+        self.corner = corner
+        # Schematics and templates are inputs and always come from the repository
+        self.circuit_dir = os.path.join(dir_path, "Circuits")
+        self.template_dir = os.path.join(dir_path, "Figures")
+
+    def _output_dir(self, name):
+        # Output directories are created on first use, not when the context is made
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def sim_dir(self):
+        return self._output_dir("Simulations")
+
+    @property
+    def fig_dir(self):
+        return self._output_dir("Figures")
+
+    @property
+    def processing_dir(self):
+        return self._output_dir("Processing")
+
+    @property
+    def vdd(self):
+        return nominal_vdd if self.corner is None else self.corner.vdd
+
+    @property
+    def archive_file(self):
+        # Where close() zips the directory to in "archive" mode
+        return os.path.join(dir_path, "Simulations", "archive", rf"{os.path.basename(self.root)}.zip")
+
+    def sim(self, name):
+        return os.path.join(self.sim_dir, name)
+
+    def fig(self, name):
+        return os.path.join(self.fig_dir, name)
+
+    def processing(self, name):
+        return os.path.join(self.processing_dir, name)
+
+    def circuit(self, name):
+        return os.path.join(self.circuit_dir, name)
+
+    def template(self, name):
+        return os.path.join(self.template_dir, name)
+
+    def close(self):
+        # Release the mapped raw files, open maps keep the directory from being removed
+        forget(self.root)
+        if self.cleanup == "keep" or not os.path.isdir(self.root):
+            return
+        if self.cleanup == "archive":
+            os.makedirs(os.path.dirname(self.archive_file), exist_ok=True)
+            shutil.make_archive(os.path.splitext(self.archive_file)[0], "zip", self.root)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __repr__(self):
+        return rf"RunContext({self.root!r}, cleanup={self.cleanup!r})"
+
+# The repository's own Simulations/Figures/Processing folders, used when no
+# context is passed and never cleaned up
+default_context = RunContext(root=dir_path, cleanup="keep")
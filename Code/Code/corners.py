@@ -0,0 +1,65 @@
+import itertools
+from collections import namedtuple
+import numpy as np
+
+from .context import nominal_vdd
+
+# One process/voltage/temperature point. process is a section of the model
+# library (log018.l), vdd the supply in V and temp the temperature in degC.
+Corner = namedtuple("Corner", ["process", "vdd", "temp"])
+
+nominal = Corner("TT", nominal_vdd, 27)
+
+process_corners = ("TT", "FF", "SS", "FS", "SF")
+supply_scales = (0.9, 1.0, 1.1)
+temperatures = (-40, 27, 125)
+
+# Direction in which each evaluate_all metric gets worse
+worst_direction = {
+    "T_settle": "max",
+    "BW_cl": "min",
+    "BW_ol": "min",
+    "SNR": "min",
+    "P": "max",
+    "FOM_dB": "min",
+}
+
+def corner_matrix(processes=process_corners, supply_scales=supply_scales, temperatures=temperatures, vdd=nominal.vdd):
+    return [Corner(p, round(vdd * scale, 6), t) for p, scale, t in itertools.product(processes, supply_scales, temperatures)]
+
+def corner_name(corner):
+    return rf"{corner.process}_{corner.vdd:g}V_{corner.temp:g}C"
+
+def tidy(results):
+    """
+    Long table with one row per corner and metric from a list of
+    (corner, evaluate_all parameters) pairs.
+    """
+    import pandas as pd
+    rows = []
+    for corner, parameters in results:
+        for metric, value in parameters.items():
+            rows.append({**corner._asdict(), "metric": metric, "value": float(np.asarray(value))})
+    return pd.DataFrame(rows, columns=list(Corner._fields) + ["metric", "value"])
+
+def worst_case(table, metrics=worst_direction):
+    """
+    Worst value of every metric over the corners and the corner it occurs at.
+    """
+    import pandas as pd
+    rows = []
+    for metric, direction in metrics.items():
+        values = table[table["metric"] == metric]
+        if values.empty:
+            continue
+        row = values.loc[values["value"].idxmax() if direction == "max" else values["value"].idxmin()]
+        nominal_values = values[(values["process"] == nominal.process) & (values["vdd"] == nominal.vdd) & (values["temp"] == nominal.temp)]["value"]
+        rows.append({
+            "metric": metric,
+            "worst": row["value"],
+            "nominal": nominal_values.iloc[0] if len(nominal_values) else np.nan,
+            "process": row["process"],
+            "vdd": row["vdd"],
+            "temp": row["temp"],
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,122 @@
+import os
+import csv
+import itertools
+import warnings
+import numpy as np
+
+from .sweep import sweep_parameters
+from .utils import spice_to_dict
+
+# Bounds of the design space the optimiser (main.ML) searches
+space = {
+    "Ibmain": (565.25e-6, 575e-6),
+    "R34": (90, 100),
+    "Rmp": (0.5, 2),
+    "Sa_b": (15, 19),
+    "Sa": (0.8, 1.15),
+    "Cin": (25e-12, 35e-12),
+}
+
+# Significant digits two design points have to share to be the same point
+key_digits = 6
+
+def read_param_file(path):
+    """
+    Design points from a file of LTspice .param lines, one point per line.
+    Commented lines like the design history in main.py ("# .param Cin=32.36p
+    ...") are read as well; lines missing a design parameter are skipped.
+    """
+    points = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip().lstrip("#").strip()
+            if not line.lower().startswith(".param"):
+                continue
+            params = spice_to_dict(line)
+            missing = [name for name in sweep_parameters if name not in params]
+            if missing:
+                warnings.warn(rf"{os.path.basename(path)}:{number} misses {', '.join(missing)}, skipped")
+                continue
+            points.append({name: params[name] for name in sweep_parameters})
+    return points
+
+def read_csv(path):
+    """
+    Design points from a CSV file with a header row naming (at least) the
+    sweep_parameters columns, in SI units.
+    """
+    with open(path, newline="") as f:
+        return [{name: float(row[name]) for name in sweep_parameters} for row in csv.DictReader(f)]
+
+def latin_hypercube(n, space=space, seed=0):
+    """
+    n points of a Latin hypercube: every parameter's range is cut into n equal
+    strata and every stratum is sampled exactly once.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, (low, high) in space.items():
+        u = (rng.permutation(n) + rng.random(n)) / n
+        columns[name] = low + u * (high - low)
+    return [{name: float(columns[name][i]) for name in space} for i in range(n)]
+
+def full_factorial(levels, space=space):
+    """
+    Every combination of levels equally spaced values per parameter. levels is
+    one number for all parameters or a dict per parameter; a parameter with a
+    single level sits in the middle of its range.
+    """
+    grids = {}
+    for name, (low, high) in space.items():
+        n = levels.get(name, 1) if isinstance(levels, dict) else levels
+        grids[name] = np.linspace(low, high, n) if n > 1 else np.array([(low + high) / 2])
+    return [dict(zip(grids, map(float, values))) for values in itertools.product(*grids.values())]
+
+def point_key(point):
+    return tuple(rf"{float(point[name]):.{key_digits}g}" for name in sweep_parameters)
+
+def read_results(path):
+    """
+    Rows of a results table, an empty list when it does not exist yet.
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def pending_points(points, path, retry_failed=False):
+    """
+    The points that are not in the results table at path yet, so an
+    interrupted batch continues where it stopped. Duplicate points are run once.
+    """
+    done = {point_key(row) for row in read_results(path) if not (retry_failed and row.get("status") != "ok")}
+    pending = []
+    for point in points:
+        key = point_key(point)
+        if key not in done:
+            done.add(key)
+            pending.append(point)
+    return pending
+
+def append_result(path, row):
+    """
+    Appends one row to the results table. The columns are the union of all
+    rows: when a row brings new ones the table is rewritten with the wider
+    header, earlier rows get empty cells.
+    """
+    row = {name: float(np.asarray(value)) if isinstance(value, (int, float, np.number, np.ndarray)) else value for name, value in row.items()}
+    rows = read_results(path)
+    header = list(rows[0]) if rows else []
+    new = [name for name in row if name not in header]
+    if rows and not new:
+        with open(path, "a", newline="") as f:
+            csv.DictWriter(f, fieldnames=header).writerow(row)
+        return
+
+    # Written next to the table and moved over it, a crash leaves either version intact
+    temp = rf"{path}.tmp"
+    with open(temp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=header + new)
+        writer.writeheader()
+        writer.writerows(rows + [row])
+    os.replace(temp, path)
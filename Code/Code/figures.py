@@ -0,0 +1,326 @@
+import os
+import json
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .trace import traced, recording, merge
+
+# matplotlib is only imported when the first figure is drawn, see pyplot()
+plt = None
+EngFormatter = None
+
+# Input-data hashes of the rendered figures, one index per figures directory
+index_name = ".figure_hashes.json"
+_lock = threading.Lock()
+
+def pyplot():
+    global plt, EngFormatter
+    if plt is None:
+        import importlib
+        import matplotlib.pyplot
+        # Only imported for the styles it registers with matplotlib
+        importlib.import_module("scienceplots")
+        from matplotlib.ticker import EngFormatter as formatter
+        matplotlib.pyplot.style.use(['science','ieee', 'no-latex'])
+        plt, EngFormatter = matplotlib.pyplot, formatter
+    return plt
+
+# The plot_* functions only draw: they take the data and metrics the readers
+# already extracted and save the figure to path.
+
+def plot_bode(path, f, A_dB, A_phase, f_3dB, tau_cl):
+    fig,ax = plt.subplots(figsize=(7,4))
+    ax.plot(f,A_dB, label="$V_o$ [dB]")
+    axtwin = ax.twinx()
+    axtwin.plot(f,A_phase, label="V_o [rad]", color="C1")
+    plt.xscale('log')
+
+    ax.set_xlabel("Frequency")
+    ax.set_ylabel("Magnitude [dB]")
+    axtwin.set_ylabel("Phase [rad]")
+
+    formatter0=EngFormatter(unit='Hz')
+    ax.xaxis.set_major_formatter(formatter0)
+
+
+    # LABELS
+    A_max = np.max(A_dB)
+    A_bot = np.min(A_dB)-5
+
+    ax.vlines(f_3dB, ymax=A_max, ymin = A_bot)
+    ax.annotate(rf"$BW_{{cl}}={f_3dB*1e-6:.3f} MHz$", (f_3dB*0.8, A_bot), ha='right')
+    ax.annotate(rf"$\tau={tau_cl:.3f} \mu s$", (f_3dB*1.2, A_bot), ha='left')
+
+    ax.set_ylim(ymin=A_bot-4)
+    plt.legend()
+    plt.tight_layout()
+    fig.savefig(path, transparent = True)
+
+def plot_loop_gain(path, f, Vo_dB, Vo_phase, Vip_dB, Vip_phase, BW_ol, PM, GM, f_GM, tau_cl):
+    fig,ax = plt.subplots(figsize=(7,4))
+    ax.plot(f,Vo_dB, "-", label="A [dB]", color="C0")
+    ax.plot(f, Vip_dB, "-", label=r"A$\beta$ [dB]", color="C1")
+    axtwin = ax.twinx()
+    axtwin.plot(f,Vo_phase, "--", label="A [rad]", color="C0")
+    axtwin.plot(f,Vip_phase, "--", label=r"A$\beta$ [rad]", color="C1")
+    plt.xscale('log')
+
+    ax.set_xlabel("Frequency")
+    ax.set_ylabel("Magnitude [dB]")
+    axtwin.set_ylabel("Phase [rad]")
+
+    formatter0=EngFormatter(unit='Hz')
+    ax.xaxis.set_major_formatter(formatter0)
+
+    # BW
+    A_bot = np.min(Vip_dB)-5
+    ax.vlines(BW_ol, ymax=0, ymin = A_bot)
+    ax.annotate(rf"$BW_{{cl}}={BW_ol*1e-6:.3f} MHz$", (BW_ol*0.8, A_bot), ha='right')
+    ax.annotate(rf"$\tau={tau_cl:.3f} \mu s$", (BW_ol*1.2, A_bot), ha='left')
+
+    # Margins
+    axtwin.annotate(
+        '',
+        xy=(BW_ol, -np.pi + PM),
+        xytext=(BW_ol, -np.pi),
+        arrowprops=dict(arrowstyle="<->")
+    )
+    axtwin.annotate(
+        rf'PM={PM:.2f}',
+        xy = (BW_ol*0.9, -np.pi + 0.5 * PM),
+        ha='right',
+        va='center'
+    )
+
+    ax.annotate(
+        '',
+        xy=(f_GM, 0),
+        xytext=(f_GM, -GM),
+        arrowprops=dict(arrowstyle="<->")
+    )
+    ax.annotate(
+        rf'GM={GM:.2f}',
+        xy = (f_GM*1.1, -0.5 * GM),
+        ha='left',
+        va='center'
+    )
+
+    ax.set_ylim(ymin=A_bot-4)
+    ax.grid()
+    plt.legend()
+    plt.tight_layout()
+    fig.savefig(path, transparent = True)
+
+def plot_transient(path, t, Vip, Vin, Vop, Von, T_settle):
+    fig, ax = plt.subplots(2,1, figsize=(7,7))
+    ax[0].plot(t, Vip, label="$V_{ip}$")
+    ax[0].plot(t, Vin, label="$V_{in}$")
+    ax[1].plot(t, Vop, label="$V_{op}$")
+    ax[1].plot(t, Von, label="$V_{on}$")
+
+    for axx in ax:
+        axx.set_xlabel("Time [$\mu$s]")
+        axx.set_ylabel("Voltage [V]")
+        axx.set_xlim(xmax=T_settle+5, xmin=0)
+
+    plt.tight_layout()
+    fig.savefig(path, transparent = True)
+
+def plot_settling(path, path_annotated, t, accuracy, T_48dB, T_40dB, T_settle, tau_cl_tran, Asettle=57, t_offset=1):
+    fig, ax = plt.subplots(figsize=(7,4))
+    ax.plot(t, accuracy)
+    ax.set_xlabel("Time [$\mu$s]")
+    ax.set_ylabel("Accuracy [dB]")
+    ax.set_ylim(ymax=accuracy[-1]*1.1)
+
+    ax.set_xlim(xmax=T_settle+4, xmin=-0.1*(T_settle+4))
+    fig.savefig(path, transparent=True)
+
+    ax.hlines([48.69, 40, Asettle], xmin=t[0], xmax=T_settle*1.1+t_offset)
+
+
+    ax.vlines(T_48dB+t_offset, ymax=48.69, ymin=np.min(accuracy))
+    ax.vlines(T_40dB+t_offset, ymax=40, ymin=np.min(accuracy))
+    ax.vlines(T_settle+t_offset, ymax=Asettle, ymin=np.min(accuracy))
+
+    for i in [T_48dB, T_40dB, T_settle]:
+        ax.annotate(rf"{i:.2f}$\mu s$", (i+t_offset, np.min(accuracy)-1), ha='center', va = "top")
+    for i in [48.69, 40, Asettle]:
+        ax.annotate(rf"{i:.2f}", (-0.25, i), ha='right', va='center')
+
+    y_pos = np.min(accuracy)+5
+    ax.annotate(
+        '',
+        xy=(T_40dB+t_offset, y_pos),
+        xytext=(T_48dB+t_offset, y_pos),
+        arrowprops=dict(arrowstyle="<->")
+    )
+    ax.annotate(
+        r'$\tau_{cl}$',
+        ((T_40dB + T_48dB) / 2+t_offset, y_pos+1),
+        ha='center',
+        va='bottom'
+    )
+    ax.annotate(
+        rf'{tau_cl_tran:.3f}',
+        ((T_40dB + T_48dB) / 2+t_offset, y_pos-1),
+        ha='center',
+        va='top'
+    )
+
+
+    fig.savefig(path_annotated, transparent=True)
+
+def plot_noise(path, f, Vonoise, noise_rms_uV, SNR):
+    fig,ax = plt.subplots(figsize=(7,4))
+    ax.set_xlabel("Frequency")
+
+    ax.loglog(f, Vonoise, label="Total noise")
+
+    formatter0=EngFormatter(unit='Hz')
+    ax.xaxis.set_major_formatter(formatter0)
+    ax.annotate(rf"Total noise = {noise_rms_uV:.2f} $\mu V_{{rms}}$, $SNR={SNR:.2f}$", (np.min(f),np.min(Vonoise)))
+
+    fig.savefig(path, transparent = True)
+
+def plot_histogram(path, values, limit, label):
+    fig,ax = plt.subplots(figsize=(7,4))
+    values = values[np.isfinite(values)]
+    ax.hist(values, bins=20)
+    ax.axvline(limit, color="C1", linestyle="--", label="Specification")
+    ax.set_xlabel(label)
+    ax.set_ylabel("Samples")
+    ax.annotate(rf"$\mu={np.mean(values):.3f}$, $\sigma={np.std(values):.3f}$", (0.02, 0.95), xycoords="axes fraction", va="top")
+
+    plt.legend()
+    plt.tight_layout()
+    fig.savefig(path, transparent = True)
+
+plotters = {
+    "bode": plot_bode,
+    "loop_gain": plot_loop_gain,
+    "transient": plot_transient,
+    "settling": plot_settling,
+    "noise": plot_noise,
+    "histogram": plot_histogram,
+}
+
+def data_hash(kind, data):
+    """
+    Hash of everything a figure is drawn from: the plot function's code and the
+    data arrays and metrics passed to it.
+    """
+    h = hashlib.sha256(kind.encode())
+    # The source rather than the bytecode, which leaves out labels, sizes and other literals
+    try:
+        h.update(inspect.getsource(plotters[kind]).encode())
+    except OSError:
+        code = plotters[kind].__code__
+        h.update(code.co_code + repr((code.co_consts, code.co_names)).encode())
+    for name in sorted(data):
+        h.update(name.encode())
+        value = data[name]
+        if isinstance(value, np.ndarray):
+            h.update(str(value.dtype).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(repr(value).encode())
+    return h.hexdigest()
+
+def _index_file(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), index_name)
+
+def _read_index(path):
+    try:
+        with open(_index_file(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def up_to_date(paths, digest):
+    index = _read_index(paths[0])
+    return all(os.path.isfile(p) and index.get(os.path.basename(p)) == digest for p in paths)
+
+def _record(paths, digest):
+    with _lock:
+        index = _read_index(paths[0])
+        index.update({os.path.basename(p): digest for p in paths})
+        with open(_index_file(paths[0]), "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+
+@traced("render")
+def render_figure(kind, paths, data):
+    """
+    Draws one figure and closes every figure the plot function opened, also
+    when it fails.
+    """
+    pyplot()
+    open_figures = set(plt.get_fignums())
+    try:
+        plotters[kind](*paths, **data)
+    finally:
+        for number in set(plt.get_fignums()) - open_figures:
+            plt.close(number)
+    return paths
+
+def _render_job(kind, paths, data):
+    # Worker side of RenderQueue: the spans go back to the parent's trace
+    with recording() as spans:
+        paths = render_figure(kind, paths, data)
+    return paths, spans
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+class RenderQueue:
+    """
+    Collects figures while the readers run and renders them afterwards in a
+    pool of headless worker processes. Figures whose input data did not change
+    since they were last rendered are skipped.
+    """
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, kind, paths, **data):
+        data = {k: np.array(v) if isinstance(v, np.ndarray) else v for k, v in data.items()}
+        self.jobs.append((kind, list(paths), data))
+
+    @traced("render", name="render_queue")
+    def run(self, processes=None):
+        todo = []
+        for kind, paths, data in self.jobs:
+            digest = data_hash(kind, data)
+            if not up_to_date(paths, digest):
+                todo.append((kind, paths, data, digest))
+        self.jobs = []
+
+        print(rf"Rendering {len(todo)} figures")
+        if len(todo) <= 1 or processes == 1:
+            for kind, paths, data, digest in todo:
+                render_figure(kind, paths, data)
+                _record(paths, digest)
+            return
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+            futures = [(pool.submit(_render_job, kind, paths, data), digest) for kind, paths, data, digest in todo]
+            for future, digest in futures:
+                paths, spans = future.result()
+                merge(spans)
+                _record(paths, digest)
+
+def figure(render, kind, paths, **data):
+    """
+    Used by the readers: queues the figure when render is a RenderQueue and
+    draws it straight away otherwise.
+    """
+    if isinstance(render, RenderQueue):
+        render.add(kind, paths, **data)
+        return
+    digest = data_hash(kind, data)
+    if up_to_date(paths, digest):
+        return
+    render_figure(kind, paths, data)
+    _record(paths, digest)
@@ -0,0 +1,194 @@
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .cache import run_cached, netlist_text
+from .context import RunContext, default_context
+from .netlist import load_netlist
+from .simulator import get_runner
+from .sweep import sweep_circuits, sweep_readers, table_expression
+from .figures import figure
+from .utils import figure_of_merit
+
+# Pelgrom mismatch of the 0.18 um devices. The threshold mismatch is lumped
+# into the current factor through gm/Id, so one width multiplier per device
+# carries both: sigma(dId/Id) = mismatch_A / sqrt(W L m) with W L in um^2.
+A_beta = 0.01       # 1 % um
+A_vt = 5e-3         # 5 mV um
+gm_id = 10          # 1/V
+mismatch_A = np.sqrt(A_beta**2 + (gm_id*A_vt)**2)
+
+# Pass criteria of a sample, the specifications of the result table
+specs = {
+    "T_settle": ("max", 2.41),
+    "SNR": ("min", 83.65),
+}
+
+_device = re.compile(r"^(M\S+)(\s.*)$", flags=re.I)
+_assignment = re.compile(r"\b([wlm])=(\{[^}]*\}|\S+)", flags=re.I)
+
+def _expression(value):
+    return value[1:-1] if value.startswith("{") else value
+
+def add_mismatch(text):
+    """
+    Gives every MOSFET of the netlist text its own standard-normal mismatch
+    parameter mm_<subcircuit>_<device>, scaled to the Pelgrom sigma of the
+    device's own l, w and m. Returns the new text and the parameter names.
+    """
+    lines = []
+    names = []
+    scope = "top"
+    for line in text.splitlines(keepends=True):
+        lower = line.strip().lower()
+        if lower.startswith(".subckt"):
+            scope = line.split()[1]
+        elif lower.startswith(".ends"):
+            scope = "top"
+
+        m = _device.match(line.strip())
+        values = {k.lower(): v for k, v in _assignment.findall(line)} if m else {}
+        if "w" in values and "l" in values:
+            name = re.sub(r"\W", "_", rf"mm_{scope}_{m.group(1)}").lower()
+            W, L, M = _expression(values["w"]), _expression(values["l"]), _expression(values.get("m", "1"))
+            w = rf"w={{({W})*(1+{name}*mc_sigma/sqrt(({W})*({L})*({M})*1e12))}}"
+            line = _assignment.sub(lambda a: w if a.group(1).lower() == "w" else a.group(0), line)
+            names.append(name)
+        lines.append(line)
+    return "".join(lines), list(dict.fromkeys(names))
+
+def mismatch_netlist(asc_file, LTC, ctx):
+    """
+    The schematic's netlist with mismatch parameters, written next to the
+    simulations and loaded as a SpiceEditor. Returns (netlist, names).
+    """
+    text = netlist_text(load_netlist(asc_file, LTC, corner=ctx.corner))
+    encoding = "utf-16" if text[:2] in (b"\xff\xfe", b"\xfe\xff") else "latin-1"
+    text, names = add_mismatch(text.decode(encoding))
+
+    net_file = ctx.sim(rf"{os.path.splitext(os.path.basename(asc_file))[0]}_mc.net")
+    with open(net_file, "w", encoding=encoding, newline="") as f:
+        f.write(text)
+    from PyLTSpice import SpiceEditor
+    return SpiceEditor(net_file), names
+
+def draw(names, n, seed, batch):
+    # Each device has its own stream, so a sample is the same in every analysis and circuit
+    return {name: np.random.default_rng([seed, batch, zlib.crc32(name.encode())]).standard_normal(n) for name in names}
+
+def write_mc(filename, design, analysis, n, seed, batch, Rbn=4.8, Rbp=6.2, LTC=None, ctx=None):
+    """
+    Steps one analysis through n mismatch samples of batch. The samples are
+    table() parameters on the step index, like write_sweep's design points.
+    Returns True on a cache hit.
+    """
+    ctx = ctx or default_context
+    circuit, instructions = sweep_circuits[analysis]
+    circuit = circuit.format(filename=filename)
+
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist, names = mismatch_netlist(ctx.circuit(rf"{circuit}.asc"), LTC, ctx)
+
+    samples = {name: table_expression(values) for name, values in draw(names, n, seed, batch).items()}
+    netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, mc_sigma=rf"{mismatch_A:.6g}", **design, **samples)
+    netlist.add_instructions(*instructions, rf".step param step_index 0 {n-1} 1")
+
+    # Named like the sweep runs, so the sweep readers read them
+    cached = run_cached(LTC, netlist, rf"{filename}_sweep_{analysis}")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
+
+def run_batch(filename, design, n, seed, batch, parallel_sims=3, corner=None):
+    """
+    Simulates and reads one batch of n samples in its own run context.
+    Returns a dict of arrays like evaluate_sweep.
+    """
+    with RunContext(name=rf"mc_{batch}", corner=corner) as ctx:
+        LTC = get_runner(ctx.sim_dir, parallel_sims=parallel_sims)
+        for analysis in sweep_circuits:
+            write_mc(filename, design, analysis, n, seed, batch, LTC=LTC, ctx=ctx)
+        LTC.wait_completion()
+
+        results = {}
+        for read in sweep_readers.values():
+            results |= read(filename, ctx=ctx)
+    results["FOM_lin"], results["FOM_dB"] = figure_of_merit(results["P"], results["tau_cl_tran"], results["SNR"])
+    return results
+
+def passes(results, specs=specs):
+    ok = np.ones(len(next(iter(results.values()))), dtype=bool)
+    for metric, (direction, limit) in specs.items():
+        values = np.asarray(results[metric])
+        ok &= (values <= limit) if direction == "max" else (values >= limit)
+    return ok
+
+def wilson(k, n, z=1.96):
+    """
+    Wilson score interval (low, high) of a yield of k passes in n samples.
+    """
+    p = k / n
+    centre = (p + z**2/(2*n)) / (1 + z**2/n)
+    half = z / (1 + z**2/n) * np.sqrt(p*(1-p)/n + z**2/(4*n**2))
+    return centre - half, centre + half
+
+def statistics(results, bins=20):
+    """
+    Mean, sigma and histogram (counts, bin edges) of every metric, ignoring
+    samples where a metric could not be measured.
+    """
+    stats = {}
+    for metric, values in results.items():
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            continue
+        stats[metric] = {
+            "mean": np.mean(values),
+            "sigma": np.std(values, ddof=1) if len(values) > 1 else 0.0,
+            "histogram": np.histogram(values, bins=bins),
+        }
+    return stats
+
+def monte_carlo(filename, design, batch_size=50, parallel_batches=2, min_samples=100, max_samples=2000, ci_width=0.05, seed=0, parallel_sims=3, ctx=None, render=True):
+    """
+    Mismatch Monte Carlo of a design. Rounds of parallel_batches stepped
+    batches run until the Wilson 95 % interval of the yield is narrower than
+    ci_width (after at least min_samples) or max_samples are done. Returns the
+    per-sample results, the yield with its interval and the statistics; the
+    samples are written to the processing folder and histograms drawn of the
+    specified metrics.
+    """
+    ctx = ctx or default_context
+    results = {}
+    batch = 0
+    while True:
+        batches = range(batch, batch + parallel_batches)
+        with ThreadPoolExecutor(max_workers=parallel_batches) as pool:
+            futures = [pool.submit(run_batch, filename, design, batch_size, seed, b, parallel_sims, ctx.corner) for b in batches]
+            for future in futures:
+                for metric, values in future.result().items():
+                    results[metric] = np.concatenate([results.get(metric, np.array([])), values])
+        batch += parallel_batches
+
+        ok = passes(results)
+        n, k = len(ok), int(np.sum(ok))
+        low, high = wilson(k, n)
+        print(rf"Monte Carlo: {n} samples, yield {k/n*100:.1f} % [{low*100:.1f}, {high*100:.1f}]")
+        if n >= max_samples or (n >= min_samples and high - low <= ci_width):
+            break
+
+    stats = statistics(results)
+    results["pass"] = ok
+    header = ",".join(results)
+    np.savetxt(ctx.processing(rf"{filename}_mc.csv"), np.column_stack(list(results.values())), delimiter=",", header=header, comments="")
+
+    if render:
+        for metric, (direction, limit) in specs.items():
+            figure(render, "histogram", [ctx.fig(rf"{filename}_mc_{metric}.pdf")], values=results[metric], limit=limit, label=metric)
+
+    return results, {"yield": k/n, "low": low, "high": high, "n": n}, stats
@@ -0,0 +1,104 @@
+import os
+import re
+import copy
+import hashlib
+import warnings
+import threading
+
+# asc path -> (mtime_ns, sha256 of the .asc, parsed SpiceEditor template)
+_templates = {}
+_lock = threading.Lock()
+
+def _digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _stamp_file(asc_file):
+    # Records which .asc the .net next to it was converted from, so other processes can reuse it
+    return os.path.splitext(asc_file)[0] + ".net.sha256"
+
+def _convert(asc_file, digest, LTC):
+    net_file = os.path.splitext(asc_file)[0] + ".net"
+    stamp_file = _stamp_file(asc_file)
+    if os.path.isfile(net_file) and os.path.isfile(stamp_file):
+        with open(stamp_file) as f:
+            if f.read().strip() == digest:
+                return net_file
+
+    # Runners that hand back an existing .net unchanged (NgspiceRunner) cannot
+    # convert it again, the .net that is there is used as it is
+    if os.path.isfile(net_file) and getattr(LTC, "keeps_netlist", False):
+        warnings.warn(rf"{os.path.basename(net_file)} is not known to match {os.path.basename(asc_file)}, using it as it is")
+        return net_file
+
+    # Only a .net that was actually written is stamped as converted from this .asc
+    before = os.stat(net_file).st_mtime_ns if os.path.isfile(net_file) else None
+    LTC.create_netlist(asc_file)
+    after = os.stat(net_file).st_mtime_ns if os.path.isfile(net_file) else None
+    if after is None or after == before:
+        raise RuntimeError(rf"{os.path.basename(net_file)} is out of date with {os.path.basename(asc_file)} and was not converted again, convert the schematic with LTspice")
+    with open(stamp_file, "w") as f:
+        f.write(digest)
+    return net_file
+
+def load_netlist(asc_file, LTC, corner=None):
+    """
+    Returns a private SpiceEditor copy of the schematic's netlist. The .asc is
+    converted and parsed once; the template is only rebuilt when the .asc
+    modification time changes and its contents hash changed as well. Callers
+    patch the copy in memory with set_parameters and add_instructions. A
+    corner (see corners.Corner) is applied to the copy.
+    """
+    asc_file = os.path.abspath(asc_file)
+    mtime = os.stat(asc_file).st_mtime_ns
+
+    with _lock:
+        entry = _templates.get(asc_file)
+        if entry is None or entry[0] != mtime:
+            digest = _digest(asc_file)
+            if entry is not None and entry[1] == digest:
+                entry = (mtime, digest, entry[2])
+            else:
+                from PyLTSpice import SpiceEditor
+                entry = (mtime, digest, SpiceEditor(_convert(asc_file, digest, LTC)))
+            _templates[asc_file] = entry
+        template = entry[2]
+
+    netlist = copy.deepcopy(template)
+    if corner is not None:
+        apply_corner(netlist, corner)
+    return netlist
+
+# The section name after the library path of a .lib line
+_lib_line = re.compile(r"^(\s*\.lib\s+(?:'[^']*'|\S+)\s+)\w+(\s*)$", flags=re.I)
+# Supply sources of the schematics: Vdd, Vddb and their copies in the loaded circuit
+_supply = re.compile(r"Vdd\w*$", flags=re.I)
+
+def _select_process(lines, process):
+    # Netlist lines are plain strings or objects printing as one (spicelib's
+    # Primitive), a rewritten line is put back as a string. Subcircuits carry
+    # their own lines and are rewritten as well
+    for i, line in enumerate(lines):
+        if hasattr(line, "netlist"):
+            _select_process(line.netlist, process)
+            continue
+        text, n = _lib_line.subn(rf"\g<1>{process}\g<2>", str(line))
+        if n:
+            lines[i] = text
+
+def apply_corner(netlist, corner):
+    """
+    Selects the process corner section of the model library, sets every
+    supply source to the corner supply and adds the corner temperature.
+    """
+    _select_process(netlist.netlist, corner.process)
+
+    for ref in netlist.get_components("V"):
+        if _supply.match(ref):
+            netlist.set_component_value(ref, rf"{corner.vdd:g}")
+
+    netlist.add_instruction(rf".temp {corner.temp:g}")
+
+def clear():
+    with _lock:
+        _templates.clear()
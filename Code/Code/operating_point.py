@@ -1,101 +1,189 @@
-import pandas as pd
 import os
-import io
-import re
+import threading
+from collections import OrderedDict
 import numpy as np
-import subprocess
-import shutil
-import ltspice
-import matplotlib.pyplot as plt
-from PyLTSpice import SimRunner, RawRead
-from PyLTSpice import SpiceEditor
 from .utils import optimize_svg
-
-from src.ltspice_to_svg import main as lt_to_svg
+from .cache import run_cached
+from .context import default_context
+from .netlist import load_netlist
+from .simulator import get_runner
+from .rawfile import read_raw
+from .template import render
+from .trace import traced
 
 dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
-def read_operating_point(filename, save=True):
-    """
-    Parses the Semiconductor Device Operating Points section from LTSpice output 
-    and returns a pandas DataFrame.
-    """
-    try:
-        filename = filename.split(".log")[0]
-        file_path = os.path.join(dir_path, "Simulations", rf"{filename}_op.log")
-        fileout = os.path.join(dir_path, "Processing", filename)
-    except:
-        file_path=filename
+op_instructions = (
+    "; Simulation settings",
+    ".op",
+)
+
+# Parsed operating-point logs, most recently used last
+max_tables = 32
+_tables = OrderedDict()
+_lock = threading.Lock()
 
-    with open(file_path, "r") as file:
-        content = file.read()
+def _encoding(path):
+    with open(path, "rb") as f:
+        start = f.read(2)
+    return "utf-16-le" if start[1:2] == b"\x00" else "latin-1"
 
+def parse_op_log(path):
+    """
+    Single pass over the Semiconductor Device Operating Points section of an
+    LTspice log. Returns a structured array with one record per device: its
+    name, model and one float field per quantity (Id, Vgs, Vth, ...), nan
+    where a device type does not report a quantity.
+    """
     start_tag = "Semiconductor Device Operating Points:"
     end_tag = "Date: "
-    try:
-        data_section = content.split(start_tag, 1)[1]
-    except IndexError:
+    devices = []
+    values = {}
+    block = []
+    found = False
+
+    with open(path, "r", encoding=_encoding(path)) as file:
+        for line in file:
+            if not found:
+                found = line.startswith(start_tag)
+                continue
+            if line.startswith(end_tag):
+                break
+            tokens = line.split()
+            if not tokens or tokens[0].startswith("---"):
+                continue
+            key = tokens[0].rstrip(":")
+            if key == "Name":
+                block = tokens[1:]
+                devices += block
+            else:
+                column = values.setdefault(key, {})
+                column.update(zip(block, tokens[1:]))
+
+    if not found:
         raise ValueError("Could not find the start of the operating points data.")
-    data_section = data_section.split(end_tag, 1)[0]
-    
-    lines = data_section.split('\n')
-    filtered_lines = [
-        line for line in lines 
-        if line.strip() and not line.strip().startswith('---')
-    ]
-    cleaned_data = '\n'.join(
-        re.sub(r'\s{2,}', ' ', line.strip()) for line in filtered_lines
-    )
-    split_data = cleaned_data.split("Name:")
-    dfs = []
-    for i in range(1, np.size(split_data)):
-        df=pd.read_csv(
-            io.StringIO(split_data[i]),
-            sep='\s+',
-            index_col=0,
-        )
-        dfs.append(df)
-    op_df = pd.concat(dfs, axis=1)
-
-    test_saturation = pd.DataFrame()
-    test_saturation[r"$\vert V_{Th} \vert$"] =  op_df.loc["Vth:"].astype("float").abs()
-    test_saturation[r"$\vert V_{GS} \vert$"] =  op_df.loc["Vgs:"].astype("float").abs()
-    test_saturation[r"$\vert V_{DS}+V_{Th} \vert$"] = op_df.loc["Vds:"].astype("float").abs() + (op_df.loc["Vth:"]).astype("float").abs()
-    test_saturation[r"$\vert V_{GT}-V_{Th} \vert$"] = op_df.loc["Vgs:"].astype("float").abs() - (op_df.loc["Vth:"]).astype("float").abs()
-    test_saturation["Saturation?"] = np.logical_and((test_saturation[r"$\vert V_{Th} \vert$"] < test_saturation[r"$\vert V_{GS} \vert$"]), (test_saturation[r"$\vert V_{GS} \vert$"] < test_saturation[r"$\vert V_{DS}+V_{Th} \vert$"]))
-    test_saturation.sort_index(axis=0, inplace=True)
-    test_saturation = test_saturation.T
-
-    tot_df = pd.concat([test_saturation, op_df])
-    tot_df.loc["Id:"] = tot_df.loc["Id:"].astype("float") * 1e6
+
+    fields = [("name", rf"U{max(map(len, devices), default=1)}")]
+    columns = {"name": devices}
+    for key, column in values.items():
+        entries = [column.get(device) for device in devices]
+        try:
+            columns[key] = [np.nan if e is None else float(e) for e in entries]
+            fields.append((key, "f8"))
+        except ValueError:
+            columns[key] = ["" if e is None else e for e in entries]
+            fields.append((key, rf"U{max(len(e) for e in columns[key])}"))
+
+    table = np.empty(len(devices), dtype=fields)
+    for key, column in columns.items():
+        table[key] = column
+    table.flags.writeable = False
+    return table
+
+def op_table(filename, ctx=None):
+    """
+    Parsed operating point of a simulation, memoised on the log path and
+    modification time.
+    """
+    ctx = ctx or default_context
+    path = os.path.abspath(ctx.sim(rf"{filename}_op.log"))
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        entry = _tables.get(path)
+        if entry is not None and entry[0] == mtime:
+            _tables.move_to_end(path)
+            return entry[1]
+
+    table = parse_op_log(path)
+    with _lock:
+        _tables[path] = (mtime, table)
+        while len(_tables) > max_tables:
+            _tables.popitem(last=False)
+    return table
+
+def clear():
+    with _lock:
+        _tables.clear()
+
+saturation_labels = {
+    "Vth": r"$\vert V_{Th} \vert$",
+    "Vgs": r"$\vert V_{GS} \vert$",
+    "Vds_Vth": r"$\vert V_{DS}+V_{Th} \vert$",
+    "Vov": r"$\vert V_{GT}-V_{Th} \vert$",
+    "saturated": "Saturation?",
+}
+
+def saturation(table):
+    """
+    Saturation check of every device in an op_table, vectorised over devices.
+    """
+    Vth = np.abs(table["Vth"])
+    Vgs = np.abs(table["Vgs"])
+    Vds_Vth = np.abs(table["Vds"]) + Vth
+    return {
+        "Vth": Vth,
+        "Vgs": Vgs,
+        "Vds_Vth": Vds_Vth,
+        "Vov": Vgs - Vth,
+        "saturated": (Vth < Vgs) & (Vgs < Vds_Vth),
+    }
+
+@traced("read")
+def read_operating_point(filename, save=True, ctx=None):
+    """
+    Operating point and saturation check of every device. With save, writes the
+    LaTeX tables and the csv to the processing directory. Returns the op_table
+    and the saturation check.
+    """
+    ctx = ctx or default_context
+    filename = filename.split(".log")[0]
+    table = op_table(filename, ctx=ctx)
+    check = saturation(table)
+
     if save==True:
+        import pandas as pd
+        fileout = ctx.processing(filename)
+        order = np.argsort(table["name"])
+        names = table["name"][order]
+        rows = {saturation_labels[key]: value[order] for key, value in check.items()}
+        for key in table.dtype.names[1:]:
+            column = table[key][order]
+            if key == "Id":
+                rows["Id:"] = column * 1e6
+            elif column.dtype.kind == "f":
+                rows[rf"{key}:"] = [rf"{v:.2e}" for v in column]
+            else:
+                rows[rf"{key}:"] = column
+        tot_df = pd.DataFrame.from_dict(rows, orient="index", columns=names)
+
         # Split the dataframe into two halves
-        df1 = tot_df.sort_index(axis=1).iloc[:, :10]  
-        df2 = tot_df.sort_index(axis=1).iloc[:, 10:] 
+        df1 = tot_df.iloc[:, :10]
+        df2 = tot_df.iloc[:, 10:]
 
 
         df1.to_latex(rf"{fileout}_op1.tex", float_format="%.2f")
         df2.to_latex(rf"{fileout}_op2.tex", float_format="%.2f")
         tot_df.to_csv(rf"{fileout}.csv")
-    return tot_df 
+    return table, check
 
-def write_operating_point(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1):
-    LTC = SimRunner(output_folder=os.path.join(dir_path, "Simulations"))
-    LTC.create_netlist(os.path.join(dir_path, "Circuits", rf"{filename}.asc"))
+@traced("write")
+def write_operating_point(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, LTC=None, ctx=None):
+    ctx = ctx or default_context
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist = load_netlist(ctx.circuit(rf"{filename}.asc"), LTC, corner=ctx.corner)
 
-
-    netlist = SpiceEditor(os.path.join(dir_path, "Circuits", rf"{filename}.net"))
-
-    netlist.add_instructions(
-    "; Simulation settings",
-    ".op",
-    )
+    netlist.add_instructions(*op_instructions)
 
     netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-    LTC.run(netlist, run_filename="closed_loop_op")
-    LTC.wait_completion(2)
+    cached = run_cached(LTC, netlist, "closed_loop_op")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
 
 def save_schematic(filename):
+    from src.ltspice_to_svg import main as lt_to_svg
     filename = filename.split(".asc")[0]
     file_path = os.path.join(dir_path, "Circuits", rf"{filename}.asc")
 
@@ -108,54 +196,51 @@ def save_schematic(filename):
 
     optimize_svg(os.path.join(dir_path, "Circuits", rf"{filename}.svg"))
 
-def annotate_voltages(filename, schematic_name):
-    template_file = os.path.join(dir_path, "Figures", rf"{schematic_name}_voltage_template.svg")
-    schematic_file = os.path.join(dir_path, "Figures", rf"{schematic_name}_voltage.svg")
-    shutil.copy(template_file, schematic_file)
+@traced("read")
+def annotate_voltages(filename, schematic_name, ctx=None):
+    ctx = ctx or default_context
+    template_file = ctx.template(rf"{schematic_name}_voltage_template.svg")
+    schematic_file = ctx.fig(rf"{schematic_name}_voltage.svg")
+
+    nodes = {
+        "Vbp": "x1:vbp",
+        "Vsp": "x1:vsp",
+        "Vcp": "x1:vcp",
+        "Vcn": "x1:vcn",
+        "Vsn": "x1:vsn",
+        "Vbn": "x1:vbn",
+        "Vdd": "n003",
+        "Vi+": "n005",
+        "Vi-": "n001",
+        "Vo-": "vop",
+        "Vo+": "von",
+        "Vgn2": "x1:vcn",
+        "Vsi": "x1:vsi",
+        "Vssi": "x1:vssi",
+        "Vbcm" : "x1:vbcm",
+        "Vpml" : "x1:vpml",
+        "Vpmr" : "x1:vpmr",
+        "Vpg" : "x1:vpg",
+        "Vnml" : "x1:vnml",
+        "Vnmr" : "x1:vnmr",
+    }
 
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_op.raw"))
+    LTR = read_raw(ctx.sim(rf"{filename}_op.raw"), traces=[rf"V({node})" for node in nodes.values()])
 
     gd = lambda s : np.float32(LTR.get_trace(rf"V({s})"))[0]
-    
-    voltages = {
-        "Vbp": gd("x1:vbp"),
-        "Vsp": gd("x1:vsp"),
-        "Vcp": gd("x1:vcp"),
-        "Vcn": gd("x1:vcn"),
-        "Vsn": gd("x1:vsn"),
-        "Vbn": gd("x1:vbn"),
-        "Vdd": gd("n003"),
-        "Vi\+": gd("n005"),
-        "Vi-": gd("n001"),
-        "Vo-": gd("vop"),
-        "Vo\+": gd("von"),
-        "Vgn2": gd("x1:vcn"),
-        "Vsi": gd("x1:vsi"),
-        "Vssi": gd("x1:vssi"),
-        "Vbcm" : gd("x1:vbcm"),
-        "Vpml" : gd("x1:vpml"),
-        "Vpmr" : gd("x1:vpmr"),
-        "Vpg" : gd("x1:vpg"),
-        "Vnml" : gd("x1:vnml"),
-        "Vnmr" : gd("x1:vnmr"),
-    }
+    voltages = {name: gd(node) for name, node in nodes.items()}
 
-    with open(schematic_file, 'r+') as f:
-        file_data = f.read()
-        for name, voltage in voltages.items():
-            file_data = re.sub(rf"{name}_V", rf"{voltage:.2f} V", file_data)
-        f.seek(0)
-        f.write(file_data)
-        f.truncate()
+    render(template_file, {name: rf"{voltage:.2f} V" for name, voltage in voltages.items()}, placeholder="{}_V", out=schematic_file)
 
-def annotate_currents(filename, schematic_name):
-    template_file = os.path.join(dir_path, "Figures", rf"{schematic_name}_current_template.svg")
-    schematic_file = os.path.join(dir_path, "Figures", rf"{schematic_name}_current.svg")
-    shutil.copy(template_file, schematic_file)
+@traced("read")
+def annotate_currents(filename, schematic_name, ctx=None):
+    ctx = ctx or default_context
+    template_file = ctx.template(rf"{schematic_name}_current_template.svg")
+    schematic_file = ctx.fig(rf"{schematic_name}_current.svg")
 
-    df = read_operating_point(filename, save=False) 
-    # print(df)
-    gd = lambda s: np.abs(np.float32(df[rf"m:x1:{s}"].loc["Id:"]))
+    table = op_table(filename, ctx=ctx)
+    Id = dict(zip(table["name"], np.abs(table["Id"]) * 1e6))
+    gd = lambda s: np.float32(Id[rf"m:x1:{s}"])
 
     currents = {
         "n3": gd("n3"),
@@ -167,10 +252,4 @@ def annotate_currents(filename, schematic_name):
         "n7": gd("n7"),
     }
 
-    with open(schematic_file, 'r+') as f:
-        file_data = f.read()
-        for name, current in currents.items():
-            file_data = re.sub(rf"{name}_uA", rf"{current:.1f} uA", file_data)
-        f.seek(0)
-        f.write(file_data)
-        f.truncate()
\ No newline at end of file
+    render(template_file, {name: rf"{current:.1f} uA" for name, current in currents.items()}, placeholder="{}_uA", out=schematic_file)
\ No newline at end of file
@@ -0,0 +1,247 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Parsed raw files, most recently used last
+max_handles = 16
+_handles = OrderedDict()
+# Results of in-memory simulator backends, keyed on the absolute .raw path,
+# most recently used last
+max_results = 16
+_results = OrderedDict()
+_lock = threading.Lock()
+
+def read_only(values):
+    values = np.asarray(values).view()
+    values.flags.writeable = False
+    return values
+
+class Trace(np.ndarray):
+    """
+    Read-only trace data of the first step, with get_wave(step) for the others.
+    """
+    handle = None
+    name = None
+
+    def get_wave(self, step=0):
+        if step == 0 or self.handle is None:
+            return np.asarray(self)
+        return self.handle.get_wave(self.name, step)
+
+class MemmapRaw:
+    """
+    Binary LTspice/ngspice raw file mapped with numpy.memmap. Only the header is
+    parsed; every trace is a zero-copy (strided) view into the mapped file, so
+    memory use does not grow with the simulation length.
+    """
+    def __init__(self, path):
+        header, offset = self._read_header(path)
+        fields = {}
+        variables = []
+        lines = header.splitlines()
+        for i, line in enumerate(lines):
+            key, _, value = line.partition(":")
+            if key == "Variables":
+                variables = [l.split("\t") for l in lines[i+1:] if l.startswith("\t")]
+                break
+            fields[key.strip()] = value.strip()
+
+        self.names = [v[2] for v in variables]
+        self.flags = fields.get("Flags", "").lower().split()
+        n_points = int(fields["No. Points"])
+        n_vars = len(self.names)
+        data_size = os.path.getsize(path) - offset
+
+        # LTspice stores real data as a float64 axis followed by float32 traces,
+        # ngspice and "double" files store everything as float64. The file size tells which.
+        if "complex" in self.flags:
+            types = ["<c16"] * n_vars
+        elif data_size == n_points * 8 * n_vars:
+            types = ["<f8"] * n_vars
+        else:
+            types = ["<f8"] + ["<f4"] * (n_vars - 1)
+
+        record = sum(np.dtype(t).itemsize for t in types)
+        if data_size < n_points * record:
+            raise ValueError(rf"{path} is truncated")
+
+        if "fastaccess" in self.flags:
+            # One contiguous block per variable
+            self.data = []
+            for t in types:
+                self.data.append(np.memmap(path, dtype=t, mode="r", offset=offset, shape=(n_points,)))
+                offset += n_points * np.dtype(t).itemsize
+        else:
+            dtype = np.dtype([(rf"v{i}", t) for i, t in enumerate(types)])
+            records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(n_points,))
+            self.data = [records[rf"v{i}"] for i in range(n_vars)]
+
+        # LTspice marks some time points with a negative sign
+        axis = self.data[0]
+        axis_abs = np.abs(axis) if axis.dtype.kind == "f" else np.abs(axis.real)
+        starts = np.flatnonzero(axis_abs == axis_abs[0]) if "stepped" in self.flags else np.array([0])
+        bounds = list(starts) + [n_points]
+        self.slices = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        self.axis = [read_only(axis_abs[s]) for s in self.slices]
+
+    @staticmethod
+    def _read_header(path):
+        with open(path, "rb") as f:
+            start = f.read(2)
+            encoding = "utf-16-le" if start[1:2] == b"\x00" else "latin-1"
+            marker = "Binary:".encode(encoding)
+            newline = "\n".encode(encoding)
+            f.seek(0)
+            head = b""
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    raise ValueError(rf"{path} is not a binary raw file")
+                head += chunk
+                index = head.find(marker)
+                end = head.find(newline, index) if index >= 0 else -1
+                if end >= 0:
+                    break
+        return head[:index].decode(encoding), end + len(newline)
+
+    def get_trace_names(self):
+        return self.names
+
+    def get_steps(self):
+        return list(range(len(self.slices)))
+
+    def waves(self, names):
+        return {name: [self.data[self.names.index(name)][s] for s in self.slices] for name in names}
+
+class RawReadSource:
+    """
+    Fallback for raw files numpy cannot map (ASCII "Values:" files): decodes the
+    requested traces with PyLTSpice's RawRead.
+    """
+    def __init__(self, path):
+        from PyLTSpice import RawRead
+        self.path = path
+        header = RawRead(path, traces_to_read=None)
+        self.names = header.get_trace_names()
+        self.axis = None
+
+    def get_trace_names(self):
+        return self.names
+
+    def get_steps(self):
+        self.waves([])
+        return list(range(len(self.axis)))
+
+    def waves(self, names):
+        if not names and self.axis is not None:
+            return {}
+        from PyLTSpice import RawRead
+        # Variable 0 is the axis, which is decoded with any trace
+        LTR = RawRead(self.path, traces_to_read=list(names) or [self.names[0]])
+        steps = LTR.get_steps()
+        if self.axis is None:
+            self.axis = [read_only(np.abs(LTR.get_axis(step))) for step in steps]
+        return {name: [read_only(LTR.get_trace(name).get_wave(step)) for step in steps] for name in names}
+
+class RawHandle:
+    """
+    One raw file in the registry. Traces are only looked up when a caller asks
+    for them and are handed out as read-only arrays.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        try:
+            self.source = MemmapRaw(path)
+        except ValueError:
+            self.source = RawReadSource(path)
+        # Raw files store lower case node names, the readers use schematic names
+        self.names = {name.lower(): name for name in self.source.get_trace_names()}
+        self.waves = {}
+        self._lock = threading.Lock()
+
+    def _name(self, name):
+        try:
+            return self.names[name.lower()]
+        except KeyError:
+            raise IndexError(rf"{name} not found in {self.path}") from None
+
+    def load(self, traces):
+        with self._lock:
+            missing = list(dict.fromkeys(self._name(t) for t in traces if self._name(t) not in self.waves))
+            if missing:
+                self.waves.update(self.source.waves(missing))
+        return self
+
+    def get_steps(self):
+        return self.source.get_steps()
+
+    def get_trace_names(self):
+        return list(self.names.values())
+
+    def get_axis(self, step=0):
+        if self.source.axis is None:
+            self.source.get_steps()
+        return self.source.axis[step].view(Trace)
+
+    def get_wave(self, name, step=0):
+        self.load([name])
+        return self.waves[self._name(name)][step]
+
+    def get_trace(self, name):
+        trace = self.get_wave(name).view(Trace)
+        trace.handle = self
+        trace.name = name
+        return trace
+
+def register(path, result):
+    """
+    Makes the in-memory result of a simulator backend available under path.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        _results[path] = result
+        _results.move_to_end(path)
+        while len(_results) > max_results:
+            _results.popitem(last=False)
+        _handles.pop(path, None)
+
+def read_raw(path, traces=()):
+    """
+    Shared raw-file registry. Each file is parsed once per modification time;
+    traces lists what the caller is going to use, so they are decoded together.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        result = _results.get(path)
+        if result is not None:
+            _results.move_to_end(path)
+            return result
+
+        handle = _handles.get(path)
+        if handle is None or handle.mtime != os.stat(path).st_mtime_ns:
+            handle = RawHandle(path)
+            _handles[path] = handle
+        _handles.move_to_end(path)
+        while len(_handles) > max_handles:
+            _handles.popitem(last=False)
+
+    return handle.load(traces)
+
+def forget(path=None):
+    """
+    Drops the registry entries of one raw file, of every raw file under a
+    directory, or all of them. Mapped files cannot be replaced or deleted on
+    Windows, so this runs before a raw file is rewritten and when a run
+    directory is removed.
+    """
+    with _lock:
+        if path is None:
+            _handles.clear()
+            _results.clear()
+            return
+        path = os.path.abspath(path)
+        for registry in (_handles, _results):
+            for key in [key for key in registry if key == path or key.startswith(path + os.sep)]:
+                del registry[key]
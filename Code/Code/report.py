@@ -0,0 +1,133 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from .context import dir_path, default_context
+from .utils import compileLatex
+from .trace import traced
+
+# The report sits in the repository root and refers to its inputs relative to it
+report_dir = os.path.dirname(dir_path)
+tex_name = "HW2_Sjoerd_Terlouw"
+
+_reference = re.compile(r"\\(input|include|includegraphics|includesvg|lstinputlisting)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}")
+_comment = re.compile(r"(?<!\\)%.*")
+
+def _tex_file(relative):
+    return relative if os.path.splitext(relative)[1] else rf"{relative}.tex"
+
+def source(relative, ctx):
+    """
+    File a path in the report resolves to: generated figures, tables and
+    processed data come from the run context, everything else from the
+    repository. Only the default context falls back to the repository's
+    figures and tables; for another context a missing one is an error, the
+    report would otherwise show another design's results.
+    """
+    parts = relative.replace("\\", "/").split("/")
+    if parts[0] == "Code" and len(parts) > 2:
+        generated = {"Figures": ctx.fig, "Processing": ctx.processing}.get(parts[1])
+        if generated is not None:
+            path = generated("/".join(parts[2:]))
+            if os.path.isfile(path):
+                return path
+            if ctx is not default_context:
+                raise FileNotFoundError(rf"{relative} was not generated in {ctx.root}")
+    return os.path.join(report_dir, *parts)
+
+def report_inputs(ctx=None, tex_name=tex_name):
+    """
+    Every file the report reads, found by following \\input, \\include,
+    \\includegraphics, \\includesvg and \\lstinputlisting from the main .tex.
+    Returns a dict of path in the report -> file it is built from.
+    """
+    ctx = ctx or default_context
+    inputs = {}
+    todo = [rf"{tex_name}.tex"]
+    while todo:
+        relative = todo.pop()
+        if relative in inputs:
+            continue
+        path = source(relative, ctx)
+        if not os.path.isfile(path):
+            warnings.warn(rf"Report input {relative} not found")
+            continue
+        inputs[relative] = path
+        if relative.endswith(".tex"):
+            with open(path, encoding="latin-1") as f:
+                text = _comment.sub("", f.read())
+            for command, reference in _reference.findall(text):
+                reference = reference.strip()
+                todo.append(_tex_file(reference) if command in ("input", "include") else reference)
+    return inputs
+
+def inputs_digest(inputs):
+    h = hashlib.sha256()
+    for relative in sorted(inputs):
+        h.update(relative.encode())
+        with open(inputs[relative], "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def _stamp_file(out_pdf):
+    # Digest of the inputs the pdf was built from
+    return rf"{out_pdf}.sha256"
+
+@traced("latex")
+def build_report(out_pdf, ctx=None, tex_name=tex_name, force=False):
+    """
+    Builds the report of one design point into out_pdf. The inputs are copied
+    into a private build directory, so several reports can be built at once,
+    and pdflatex and gs are skipped when no input changed since out_pdf was
+    built. Returns True when the report was compiled.
+    """
+    ctx = ctx or default_context
+    inputs = report_inputs(ctx, tex_name=tex_name)
+    digest = inputs_digest(inputs)
+    stamp_file = _stamp_file(out_pdf)
+    aux_file = os.path.splitext(out_pdf)[0] + ".aux"
+    if not force and os.path.isfile(out_pdf) and os.path.isfile(stamp_file):
+        with open(stamp_file) as f:
+            if f.read().strip() == digest:
+                print(rf"Report {os.path.basename(out_pdf)} is up to date")
+                return False
+
+    build_dir = tempfile.mkdtemp(prefix="report_")
+    try:
+        for relative, path in inputs.items():
+            target = os.path.join(build_dir, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+
+        # The .aux of the previous build starts the references off resolved,
+        # so an unchanged document compiles in one pdflatex pass
+        aux = os.path.join(build_dir, rf"{tex_name}.aux")
+        if os.path.isfile(aux_file):
+            shutil.copyfile(aux_file, aux)
+
+        compileLatex(dir_path=build_dir, tex_name=tex_name)
+        pdf = os.path.join(build_dir, rf"{tex_name}.pdf")
+        if not os.path.isfile(pdf):
+            warnings.warn(rf"No pdf was produced for {os.path.basename(out_pdf)}")
+            return False
+        shutil.copyfile(pdf, out_pdf)
+        if os.path.isfile(aux):
+            shutil.copyfile(aux, aux_file)
+        with open(stamp_file, "w") as f:
+            f.write(digest)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return True
+
+def build_reports(jobs, n_jobs=4, tex_name=tex_name, force=False):
+    """
+    Builds the reports of several design points in parallel. jobs is an
+    iterable of (out_pdf, run context) pairs.
+    """
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(build_report, out_pdf, ctx, tex_name, force) for out_pdf, ctx in jobs]
+        return [future.result() for future in futures]
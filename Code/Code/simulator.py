@@ -0,0 +1,396 @@
+import os
+import re
+import ctypes
+import ctypes.util
+import threading
+import numpy as np
+
+from .cache import netlist_text, decode_netlist
+from .rawfile import Trace, read_only, register
+
+# "ltspice" spawns LTspice through PyLTSpice, "ngspice" runs in-process on libngspice
+backend = os.environ.get("HW2_SIMULATOR", "ltspice").lower()
+
+def set_backend(name):
+    global backend
+    if name not in ("ltspice", "ngspice"):
+        raise ValueError(rf"Unknown simulator backend {name}")
+    backend = name
+
+def get_runner(output_folder, parallel_sims=4):
+    """
+    Returns a runner for the selected backend. Every runner has the SimRunner
+    interface used by the write_* functions: create_netlist, run,
+    wait_completion and iteration over (raw_file, log_file) of finished runs.
+    """
+    if backend == "ngspice":
+        return NgspiceRunner(output_folder=output_folder)
+    from PyLTSpice import SimRunner
+    return SimRunner(output_folder=output_folder, parallel_sims=parallel_sims)
+
+class VectorSet:
+    """
+    Vectors of one ngspice plot, exposed with the part of the RawRead interface
+    the readers use. Trace names are given in LTspice form (V(n001), I(vdd),
+    V(x1:vbp), V(onoise)).
+    """
+    def __init__(self, axis_name, vectors):
+        self.axis_name = axis_name
+        self.vectors = {name.lower(): value for name, value in vectors.items()}
+
+    def load(self, traces):
+        return self
+
+    def get_steps(self):
+        return [0]
+
+    def get_trace_names(self):
+        return list(self.vectors)
+
+    def get_axis(self, step=0):
+        return read_only(self.vectors[self.axis_name]).view(Trace)
+
+    def get_trace(self, name):
+        for candidate in self._candidates(name):
+            if candidate in self.vectors:
+                return read_only(self.vectors[candidate]).view(Trace)
+        raise IndexError(rf"{name} not found in ngspice results")
+
+    @staticmethod
+    def _candidates(name):
+        name = name.lower()
+        m = re.fullmatch(r"([vi])\((.*)\)", name)
+        if m is None:
+            return [name]
+        kind, node = m.groups()
+        node = node.replace(":", ".")
+        if kind == "i":
+            return [rf"{node}#branch", rf"i({node})"]
+        if node == "onoise":
+            return ["onoise_spectrum", node]
+        return [node, rf"v({node})"]
+
+class _VectorInfo(ctypes.Structure):
+    _fields_ = [
+        ("v_name", ctypes.c_char_p),
+        ("v_type", ctypes.c_int),
+        ("v_flags", ctypes.c_short),
+        ("v_realdata", ctypes.POINTER(ctypes.c_double)),
+        ("v_compdata", ctypes.POINTER(ctypes.c_double)),
+        ("v_length", ctypes.c_int),
+    ]
+
+_print_fn = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+_status_fn = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p)
+_exit_fn = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_int, ctypes.c_bool, ctypes.c_bool, ctypes.c_int, ctypes.c_void_p)
+_bg_fn = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_bool, ctypes.c_int, ctypes.c_void_p)
+
+class NgspiceLibrary:
+    """
+    Thin ctypes wrapper around the ngspice shared library. libngspice keeps a
+    single global circuit, so there is one instance per process.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        path = os.environ.get("NGSPICE_LIBRARY_PATH") or ctypes.util.find_library("ngspice")
+        if path is None:
+            raise OSError("libngspice not found, set NGSPICE_LIBRARY_PATH")
+        self.lib = ctypes.CDLL(path)
+        self.lib.ngGet_Vec_Info.restype = ctypes.POINTER(_VectorInfo)
+        self.lib.ngSpice_CurPlot.restype = ctypes.c_char_p
+        self.lib.ngSpice_AllVecs.restype = ctypes.POINTER(ctypes.c_char_p)
+        self.output = []
+        # Keep references to the callbacks, ngspice calls them for the lifetime of the library
+        self._callbacks = (
+            _print_fn(lambda text, ident, data: self.output.append(text.decode(errors="replace")) or 0),
+            _status_fn(lambda text, ident, data: 0),
+            _exit_fn(lambda status, unload, quit, ident, data: 0),
+            _bg_fn(lambda running, ident, data: 0),
+        )
+        self.lib.ngSpice_Init(self._callbacks[0], self._callbacks[1], self._callbacks[2], None, None, self._callbacks[3], None)
+        self.command("set ngbehavior=ltpsa")
+        self.loaded = None
+
+    def command(self, cmd):
+        if self.lib.ngSpice_Command(cmd.encode()) != 0:
+            raise RuntimeError(rf"ngspice command failed: {cmd}")
+
+    def load(self, lines):
+        array = (ctypes.c_char_p * (len(lines) + 1))(*[line.encode() for line in lines], None)
+        if self.lib.ngSpice_Circ(array) != 0:
+            raise RuntimeError("ngspice could not load the circuit")
+
+    def vectors(self, plot):
+        names = self.lib.ngSpice_AllVecs(plot.encode())
+        vectors = {}
+        i = 0
+        while names[i] is not None:
+            name = names[i].decode()
+            info = self.lib.ngGet_Vec_Info(rf"{plot}.{name}".encode()).contents
+            if info.v_realdata:
+                vectors[name] = np.ctypeslib.as_array(info.v_realdata, shape=(info.v_length,)).copy()
+            else:
+                data = np.ctypeslib.as_array(info.v_compdata, shape=(2 * info.v_length,))
+                vectors[name] = (data[0::2] + 1j * data[1::2]).copy()
+            i += 1
+        return vectors
+
+_analysis_directives = (".tran", ".ac", ".noise", ".op", ".dc")
+_dropped_directives = (".backanno", ".save", ".options plotwinsize")
+_axis_names = {"tran": "time", "ac": "frequency", "noise": "frequency", "dc": "v-sweep"}
+
+def split_netlist(text):
+    """
+    Splits an LTspice netlist into the circuit lines ngspice loads, the top-level
+    .param assignments, the analysis directive and the .meas directives.
+    """
+    circuit, params, analysis, measurements = [], {}, None, []
+    depth = 0
+    for line in text.splitlines():
+        stripped = line.strip()
+        lower = stripped.lower()
+        if lower.startswith(".subckt"):
+            depth += 1
+        elif lower.startswith(".ends"):
+            depth -= 1
+
+        if depth == 0 and lower.startswith(_analysis_directives):
+            analysis = stripped[1:]
+        elif lower == ".end" or lower.startswith(_dropped_directives):
+            continue
+        elif lower.startswith(".meas"):
+            measurements.append(stripped)
+        elif depth == 0 and re.match(r"\.params?\s", lower):
+            params |= dict(re.findall(r"(\w+)\s*=\s*(\S+)", stripped[stripped.index(" "):]))
+        else:
+            if lower.startswith(".params "):
+                line = ".param " + stripped[len(".params "):]
+            circuit.append(_remap_lib(line))
+    return circuit, params, analysis, measurements
+
+def _remap_lib(line):
+    # Model libraries are referenced with Windows paths in the schematics
+    model_dir = os.environ.get("HW2_MODEL_DIR")
+    m = re.match(r"(\.lib\s+)'?([^'\s]+)'?(.*)", line.strip(), flags=re.I)
+    if model_dir is None or m is None:
+        return line
+    lib, path, corner = m.groups()
+    path = os.path.join(model_dir, re.split(r"[\\/]", path)[-1])
+    return rf"{lib}'{path}'{corner}"
+
+_suffixes = {"t": 1e12, "g": 1e9, "meg": 1e6, "k": 1e3, "m": 1e-3, "u": 1e-6, "n": 1e-9, "p": 1e-12, "f": 1e-15}
+_number = r"((?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)(meg|[tgkmunpf])?[a-z]*"
+
+def spice_number(text):
+    m = re.fullmatch(rf"([-+]?){_number}", text.strip().lower())
+    if m is None:
+        raise ValueError(rf"{text} is not a number")
+    sign, value, suffix = m.groups()
+    return float(sign + value) * _suffixes.get(suffix, 1)
+
+_functions = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "ln": np.log, "log": np.log, "log10": np.log10,
+    "pow": np.power, "pwr": lambda x, y: np.abs(x)**y, "min": np.minimum, "max": np.maximum,
+}
+
+def _evaluate(expression, scope, result, sample):
+    # LTspice expression in Python syntax; V() and I() return sample(wave) of the trace
+    def V(a, b="0"):
+        wave = 0 if a == "0" else np.asarray(result.get_trace(rf"V({a})"))
+        return sample(wave - (0 if b == "0" else np.asarray(result.get_trace(rf"V({b})"))))
+
+    def I(a):
+        return sample(np.asarray(result.get_trace(rf"I({a})")))
+
+    code = re.sub(rf"(?<![\w.]){_number}", lambda m: repr(spice_number(m.group(0))), expression.lower())
+    code = re.sub(r"\b([vi])\(([^()]*)\)", lambda m: m.group(1) + "(" + ",".join(repr(node.strip()) for node in m.group(2).split(",")) + ")", code)
+    return eval(code.replace("^", "**"), {"__builtins__": {}}, {**_functions, **scope, "v": V, "i": I})
+
+def _format(value):
+    # Complex (AC) results are logged as LTspice does, magnitude in dB and phase
+    if np.iscomplexobj(value):
+        return rf"({20*np.log10(np.abs(value)):.6g}dB,{np.degrees(np.angle(value)):.6g}°)"
+    return rf"{float(value):.6g}"
+
+def _integral(t, values):
+    return np.sum(np.diff(t) * (values[1:] + values[:-1]) / 2)
+
+_reductions = {
+    "max": lambda t, v: np.max(v),
+    "min": lambda t, v: np.min(v),
+    "pp": lambda t, v: np.max(v) - np.min(v),
+    "avg": lambda t, v: _integral(t, v) / (t[-1] - t[0]),
+    "rms": lambda t, v: np.sqrt(_integral(t, np.abs(v)**2) / (t[-1] - t[0])),
+}
+
+def measure(measurements, result, params):
+    """
+    Evaluates LTspice .meas directives on the vectors of an ngspice run:
+    FIND <expr> AT <x>, MAX/MIN/PP/AVG/RMS <expr> [FROM <x>] [TO <x>] and
+    PARAM <expr>. Returns the lines LTspice writes for them to its log, so
+    LTSpiceLogReader reads them unchanged.
+    """
+    scope = {}
+    for name, value in params.items():
+        try:
+            scope[name.lower()] = spice_number(value)
+        except ValueError:
+            pass
+
+    axis = np.abs(np.real(np.asarray(result.get_axis()))) if result.axis_name in result.vectors else None
+    lines = []
+    for directive in measurements:
+        m = re.match(r"\.meas(?:ure)?\s+(?:(?:tran|ac|noise|dc|op)\s+)?(\w+)\s+(.*)", directive, flags=re.I)
+        if m is None:
+            continue
+        name, spec = m.group(1).lower(), m.group(2).strip()
+        find = re.fullmatch(r"find\s+(.+?)\s+at\s*=?\s*(\S+)", spec, flags=re.I)
+        window = re.fullmatch(r"(max|min|pp|avg|rms)\s+(.+?)(?:\s+from\s*=?\s*(\S+))?(?:\s+to\s*=?\s*(\S+))?", spec, flags=re.I)
+        param = re.fullmatch(r"param\s+(.+)", spec, flags=re.I)
+        try:
+            if find:
+                expression, at = find.group(1).lower(), spice_number(find.group(2))
+                value = _evaluate(expression, scope, result, lambda wave: np.interp(at, axis, wave))
+                line = rf"{name}: {expression}={_format(value)} at {at:g}"
+            elif window:
+                kind, expression = window.group(1).lower(), window.group(2).lower()
+                start = spice_number(window.group(3)) if window.group(3) else axis[0]
+                stop = spice_number(window.group(4)) if window.group(4) else axis[-1]
+                inside = (axis >= start) & (axis <= stop)
+                value = _reductions[kind](axis[inside], _evaluate(expression, scope, result, lambda wave: np.broadcast_to(wave, axis.shape)[inside]))
+                line = rf"{name}: {kind.upper()}({expression})={_format(value)} FROM {start:g} TO {stop:g}"
+            elif param:
+                expression = param.group(1).lower()
+                value = _evaluate(expression, scope, result, lambda wave: wave)
+                line = rf"{name}: {expression}={_format(value)}"
+            else:
+                raise ValueError(rf"Unsupported measurement {directive}")
+        except Exception:
+            lines.append(rf"""Measurement "{name}" FAIL'ed""")
+            continue
+        scope[name] = value
+        lines.append(line)
+    return lines
+
+# ngspice show quantities under their LTspice log names
+_op_names = {"model": "Model", "id": "Id", "vgs": "Vgs", "vds": "Vds", "vbs": "Vbs", "vth": "Vth", "vdsat": "Vdsat", "gm": "Gm", "gds": "Gds", "gmbs": "Gmb"}
+
+def _device_name(name):
+    # ngspice m.x1.mn3 is m:x1:n3 in LTspice
+    parts = name.lower().split(".")
+    if len(parts) > 1:
+        parts[-1] = parts[-1][1:]
+    return ":".join(parts)
+
+def op_section(output):
+    """
+    The MOSFET operating points printed by ngspice's show command, as the
+    Semiconductor Device Operating Points section of an LTspice log.
+    """
+    blocks = []
+    block = None
+    for line in output:
+        tokens = line.split()
+        if tokens[:1] in (["stdout"], ["stderr"]):
+            tokens = tokens[1:]
+        if not tokens:
+            continue
+        key = tokens[0].lower()
+        if key == "device":
+            block = {"Name": [_device_name(token) for token in tokens[1:]]}
+            blocks.append(block)
+        elif block is not None and len(tokens) == len(block["Name"]) + 1:
+            block[_op_names.get(key, key.capitalize())] = tokens[1:]
+
+    lines = ["Semiconductor Device Operating Points:"]
+    for block in blocks:
+        lines.append("                                   --- MOSFET Transistors ---")
+        lines += [rf"{key + ':':<8}" + "".join(rf"{value:>16}" for value in values) for key, values in block.items()]
+        lines.append("")
+    return lines
+
+class NgspiceRunner:
+    """
+    In-process ngspice backend with the SimRunner interface. The circuit is
+    loaded once; later runs that only differ in top-level .param values alter
+    them in memory. Results are kept as NumPy arrays and handed to the readers
+    through read_raw, no raw file is written. The log holds the .meas results
+    and, for .op runs, the device operating points in LTspice's format.
+    """
+    in_memory = True
+    # An existing .net is returned as it is, not converted from the .asc again
+    keeps_netlist = True
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.finished = []
+
+    def create_netlist(self, asc_file):
+        net_file = os.path.splitext(asc_file)[0] + ".net"
+        if os.path.isfile(net_file):
+            return net_file
+        # Converting schematics still needs LTspice
+        from PyLTSpice import SimRunner
+        return SimRunner(output_folder=self.output_folder).create_netlist(asc_file)
+
+    def run(self, netlist, run_filename, callback=None, **kwargs):
+        text = netlist_text(netlist)
+        circuit, params, analysis, measurements = split_netlist(decode_netlist(text))
+        if analysis is None:
+            raise ValueError("Netlist has no analysis directive")
+
+        raw_file = os.path.join(self.output_folder, rf"{run_filename}.raw")
+        log_file = os.path.join(self.output_folder, rf"{run_filename}.log")
+
+        ng = NgspiceLibrary.get()
+        with NgspiceLibrary._lock:
+            ng.output.clear()
+            ng.command("destroy all")
+            if ng.loaded != circuit:
+                ng.load(circuit + [rf".param {name}={value}" for name, value in params.items()] + [".end"])
+                ng.loaded = circuit
+            else:
+                for name, value in params.items():
+                    ng.command(rf"alterparam {name}={value.strip('{}')}")
+                ng.command("reset")
+            ng.command(analysis)
+
+            kind = analysis.split()[0].lower()
+            plot = "noise1" if kind == "noise" else ng.lib.ngSpice_CurPlot().decode()
+            vectors = VectorSet(_axis_names.get(kind, "time"), ng.vectors(plot))
+            register(raw_file, vectors)
+
+            log = list(ng.output)
+            if kind == "op":
+                ng.output.clear()
+                ng.command("show m : " + " ".join(name for name in _op_names if name != "model"))
+                log += op_section(ng.output)
+            log += measure(measurements, vectors, params)
+            with open(log_file, "w") as f:
+                f.write("\n".join(log))
+
+        result = (raw_file, log_file)
+        if callback is not None:
+            result = callback(raw_file, log_file)
+        self.finished.append(result)
+
+    def wait_completion(self, timeout=None):
+        # Runs are synchronous
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.finished:
+            raise StopIteration
+        return self.finished.pop(0)
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from .context import dir_path
+
+# Optimiser evaluations, one row per objective call
+db_path = os.path.join(dir_path, "evaluations.sqlite")
+
+# Order of the optimiser's parameter vector
+parameters = ("Ibmain", "R34", "Rmp", "Sa_b", "Sa", "Cin")
+metrics = ("a0", "a1", "current", "SNR", "fom")
+
+# Relative tolerance under which two parameter vectors are the same point
+same_point = 1e-9
+
+_connections = {}
+_lock = threading.Lock()
+
+_schema = rf"""
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    {", ".join(rf"{name} REAL NOT NULL" for name in parameters)},
+    {", ".join(rf"{name} REAL" for name in metrics)},
+    duration REAL,
+    status TEXT NOT NULL,
+    traces TEXT,
+    stages TEXT
+);
+CREATE INDEX IF NOT EXISTS evaluations_parameters ON evaluations ({", ".join(parameters)});
+CREATE INDEX IF NOT EXISTS evaluations_fom ON evaluations (fom);
+"""
+
+def connect(path=None):
+    """
+    One shared connection per database file. Writes from the batch threads
+    are serialised by the module lock.
+    """
+    path = os.path.abspath(path or db_path)
+    with _lock:
+        db = _connections.get(path)
+        if db is None:
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_schema)
+            # Stores from before the per-stage summaries
+            if "stages" not in [row[1] for row in db.execute("PRAGMA table_info(evaluations)")]:
+                db.execute("ALTER TABLE evaluations ADD COLUMN stages TEXT")
+            _connections[path] = db
+    return db
+
+def record(params, fom, values=None, duration=None, status="ok", traces=None, stages=None, path=None):
+    """
+    Stores one evaluation: the parameter vector in optimiser order, the fom,
+    the measured metrics in values, the wall time it took, its status
+    ("ok", "screened" or "failed"), where its traces were archived and
+    the trace.summary of its stages (stored as JSON).
+    """
+    values = dict(values or {}, fom=fom)
+    columns = ("time",) + parameters + metrics + ("duration", "status", "traces", "stages")
+    row = (time.time(), *map(float, params), *(None if values.get(m) is None else float(values[m]) for m in metrics), duration, status, traces,
+           None if stages is None else json.dumps(stages))
+    db = connect(path)
+    with _lock:
+        db.execute(rf"INSERT INTO evaluations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", row)
+
+def lookup(params, path=None):
+    """
+    fom of an earlier simulated evaluation of the same point, or None. Points
+    the surrogate screened only have a predicted fom and are simulated again.
+    """
+    where = " AND ".join(rf"{name} BETWEEN ? AND ?" for name in parameters)
+    bounds = []
+    for value in map(float, params):
+        delta = abs(value) * same_point
+        bounds += [value - delta, value + delta]
+    db = connect(path)
+    with _lock:
+        row = db.execute(rf"SELECT fom FROM evaluations WHERE {where} AND status = 'ok' ORDER BY id DESC LIMIT 1", bounds).fetchone()
+    return None if row is None else row[0]
+
+def history(limit=None, path=None):
+    """
+    (x0, y0) to warm-start the optimiser, the best limit evaluations by fom
+    when limit is given. Failed points are included, the optimiser should
+    keep avoiding them; screened points are not, their fom is only predicted.
+    """
+    query = rf"SELECT {', '.join(parameters)}, fom FROM evaluations WHERE fom IS NOT NULL AND status != 'screened' ORDER BY fom"
+    if limit is not None:
+        query += rf" LIMIT {int(limit)}"
+    db = connect(path)
+    with _lock:
+        rows = db.execute(query).fetchall()
+    return [list(row[:-1]) for row in rows], [row[-1] for row in rows]
+
+def query(sql, args=(), path=None):
+    """
+    Rows of an arbitrary query for post-hoc analysis, e.g.
+    query("SELECT Sa, fom FROM evaluations WHERE status = 'ok' AND fom < ?", (1e3,)).
+    """
+    db = connect(path)
+    with _lock:
+        return db.execute(sql, args).fetchall()
+
+def import_csv(csv_file, path=None):
+    """
+    Imports an old optimization_log.csv (time, Ibmain, R34, Rmp, Sa_b, Sa, Cin, fom
+    without a header) into the store.
+    """
+    rows = []
+    with open(csv_file) as f:
+        for line in f:
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != len(parameters) + 2:
+                continue
+            stamp = time.mktime(time.strptime(fields[0]))
+            fom = float(fields[-1])
+            rows.append((stamp, *map(float, fields[1:-1]), fom, "failed" if fom >= 1e30 else "ok"))
+
+    columns = ("time",) + parameters + ("fom", "status")
+    db = connect(path)
+    with _lock:
+        db.executemany(rf"INSERT INTO evaluations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+    return len(rows)
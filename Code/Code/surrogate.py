@@ -0,0 +1,123 @@
+import numpy as np
+
+from .transient import t_offset, settling_metrics, A_step as A_initial
+
+def _split(poles):
+    # Real poles and the upper half of the complex-conjugate pairs
+    poles = np.asarray(poles, dtype=complex)
+    tol = 1e-8 * np.maximum(np.abs(poles), 1)
+    real = poles[np.abs(poles.imag) <= tol].real
+    pairs = poles[poles.imag > tol]
+    return real, pairs
+
+def _basis(s, real, pairs):
+    columns = [1/(s-p) for p in real]
+    for p in pairs:
+        columns += [1/(s-p) + 1/(s-np.conj(p)), 1j/(s-p) - 1j/(s-np.conj(p))]
+    return np.stack(columns, axis=1)
+
+def _state(real, pairs):
+    n = len(real) + 2*len(pairs)
+    A = np.zeros((n, n))
+    b = np.zeros(n)
+    A[range(len(real)), range(len(real))] = real
+    b[:len(real)] = 1
+    for k, p in enumerate(pairs):
+        i = len(real) + 2*k
+        A[i:i+2, i:i+2] = [[p.real, p.imag], [-p.imag, p.real]]
+        b[i] = 2
+    return A, b
+
+def _solve(M, H, weight):
+    # Least squares with real coefficients on the stacked real and imaginary parts
+    # Columns are scaled to unit norm, the basis spans many decades in magnitude
+    M = np.vstack([(M * weight[:, None]).real, (M * weight[:, None]).imag])
+    scale = np.linalg.norm(M, axis=0)
+    scale[scale == 0] = 1
+    x, *_ = np.linalg.lstsq(M / scale, np.concatenate([(H * weight).real, (H * weight).imag]), rcond=None)
+    return x / scale
+
+def vector_fit(f, H, n_poles=6, n_iter=10):
+    """
+    Rational fit H(s) ~ d + sum(r/(s-p)) of a frequency response by vector
+    fitting, relative to |H|. Returns (poles, residues, d) with every complex
+    pole and residue followed by its conjugate.
+    """
+    f = np.asarray(f, dtype=float)
+    H = np.asarray(H, dtype=complex)
+    s = 2j*np.pi*f
+    weight = 1/np.maximum(np.abs(H), 1e-12)
+
+    w = 2*np.pi*np.logspace(np.log10(max(f[0], 1e-3)), np.log10(f[-1]), n_poles//2)
+    real, pairs = np.array([]), -w/100 + 1j*w
+    if n_poles % 2:
+        real = np.array([-2*np.pi*np.sqrt(max(f[0], 1e-3)*f[-1])])
+
+    for _ in range(n_iter):
+        # Pole relocation: fit sigma*H and sigma with the same poles, sigma(inf) = 1
+        Phi = _basis(s, real, pairs)
+        n = Phi.shape[1]
+        x = _solve(np.hstack([Phi, np.ones((len(s), 1)), -H[:, None]*Phi]), H, weight)
+        A, b = _state(real, pairs)
+        zeros = np.linalg.eigvals(A - np.outer(b, x[n+1:]))
+        # Unstable poles are flipped into the left half-plane
+        zeros = -np.abs(zeros.real) + 1j*zeros.imag
+        real, pairs = _split(zeros)
+
+    Phi = _basis(s, real, pairs)
+    x = _solve(np.hstack([Phi, np.ones((len(s), 1))]), H, weight)
+    poles = list(real)
+    residues = list(x[:len(real)])
+    for k, p in enumerate(pairs):
+        r = x[len(real)+2*k] + 1j*x[len(real)+2*k+1]
+        poles += [p, np.conj(p)]
+        residues += [r, np.conj(r)]
+    return np.array(poles, dtype=complex), np.array(residues, dtype=complex), x[-1]
+
+def evaluate(model, f):
+    poles, residues, d = model
+    s = 2j*np.pi*np.asarray(f, dtype=float)
+    return d + np.sum(residues / (s[:, None] - poles), axis=-1)
+
+def step_error(model, t):
+    """
+    Step response minus its final value, y(t) - H(0), at times t in s after the step.
+    """
+    poles, residues, d = model
+    t = np.asarray(t, dtype=float)
+    return np.real(np.sum(residues/poles * np.exp(np.multiply.outer(t, poles)), axis=-1))
+
+def surrogate_accuracy(model, t):
+    """
+    Settling accuracy in dB at times t in us after the step. The virtual-ground
+    error is assumed to decay like the relative error of the closed-loop step
+    response, starting from A_initial.
+    """
+    e = np.abs(step_error(model, np.asarray(t) * 1e-6))
+    e0 = np.abs(step_error(model, 0.0))
+    return A_initial - 20*np.log10((e + 1e-30) / (e0 + 1e-30))
+
+def fit_closed_loop(f, A_CL, n_poles=6, n_iter=10, f_max=None):
+    """
+    Vector fit of the closed-loop response from closed_loop_response and its
+    relative rms fit error.
+    """
+    f = np.asarray(f)
+    A_CL = np.asarray(A_CL)
+    if f_max is not None:
+        A_CL = A_CL[f <= f_max]
+        f = f[f <= f_max]
+    model = vector_fit(f, A_CL, n_poles=n_poles, n_iter=n_iter)
+    error = np.sqrt(np.mean(np.abs(evaluate(model, f)/A_CL - 1)**2))
+    return model, error
+
+def settling_estimate(f, A_CL, Asettle=57, n_poles=6, t_stop=100, n_points=20001):
+    """
+    T_48dB, T_40dB, T_settle and tau_cl_tran in us predicted from the AC
+    closed-loop response, as returned by settling_metrics for the transient.
+    """
+    model, error = fit_closed_loop(f, A_CL, n_poles=n_poles)
+    t = np.linspace(0, t_stop, n_points)
+    parameters = settling_metrics(t + t_offset, surrogate_accuracy(model, t), Asettle=Asettle)
+    parameters["fit_error"] = error
+    return parameters, model
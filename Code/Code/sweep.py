@@ -0,0 +1,149 @@
+import numpy as np
+
+from .cache import run_cached
+from .context import default_context
+from .netlist import load_netlist
+from .simulator import get_runner
+from .rawfile import read_raw
+from .transient import tran_instructions, accuracy_dB, settling_metrics
+from .ac import ac_instructions, open_loop_metrics
+from .onoise import noise_instructions, noise_metrics
+from .utils import figure_of_merit
+
+# Column order of design points given as an array
+sweep_parameters = ("Sa", "R34", "Rmp", "Ibmain", "Cin", "Sa_b")
+
+sweep_circuits = {
+    "tran": ("{filename}", tran_instructions),
+    "ac": ("{filename}_loaded", ac_instructions),
+    "noise": ("{filename}", noise_instructions),
+}
+
+def as_columns(points):
+    """
+    Design points as a dict of equally long 1-D arrays. Accepts a list of dicts,
+    a dict of sequences or an N x 6 array in sweep_parameters order.
+    """
+    if isinstance(points, dict):
+        columns = {name: np.atleast_1d(np.asarray(points[name], dtype=float)) for name in sweep_parameters}
+    elif len(points) and isinstance(points[0], dict):
+        columns = {name: np.array([p[name] for p in points], dtype=float) for name in sweep_parameters}
+    else:
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        columns = {name: points[:, i] for i, name in enumerate(sweep_parameters)}
+
+    if len({len(values) for values in columns.values()}) != 1:
+        raise ValueError("All design parameters need the same number of points")
+    return columns
+
+def table_expression(values):
+    # Piecewise-linear LTspice table() on the integer step index returns values[i] at i
+    pairs = ",".join(rf"{i},{v:.12g}" for i, v in enumerate(values))
+    return rf"{{table(step_index,{pairs})}}"
+
+def write_sweep(filename, points, analysis, Rbn=4.8, Rbp=6.2, LTC=None, ctx=None):
+    """
+    Writes one netlist that steps through all design points with .step and
+    table() driven parameters, and runs it. Returns True on a cache hit.
+    """
+    ctx = ctx or default_context
+    columns = as_columns(points)
+    n = len(columns["Sa"])
+    circuit, instructions = sweep_circuits[analysis]
+    circuit = circuit.format(filename=filename)
+
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist = load_netlist(ctx.circuit(rf"{circuit}.asc"), LTC, corner=ctx.corner)
+
+    netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, **{name: table_expression(values) for name, values in columns.items()})
+    netlist.add_instructions(*instructions, rf".step param step_index 0 {n-1} 1")
+
+    cached = run_cached(LTC, netlist, rf"{filename}_sweep_{analysis}")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
+
+def _stack(LTR, trace):
+    return np.stack([np.asarray(LTR.get_trace(trace).get_wave(step)) for step in LTR.get_steps()])
+
+def read_sweep_tran(filename, Asettle=57, ctx=None):
+    """
+    virtual_ground_settling metrics and supply current for every step. Steps
+    have their own adaptive time axis, so the accuracy traces are resampled on a
+    common grid first and the crossings are then found on the 2-D array at once.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_sweep_tran.raw"), traces=["V(n001)", "V(n005)", "I(vdd)"])
+    steps = LTR.get_steps()
+
+    axes = [np.abs(np.asarray(LTR.get_axis(step))) * 1e6 for step in steps]
+    t = np.linspace(0, min(axis[-1] for axis in axes), max(len(axis) for axis in axes))
+
+    accuracy = np.empty((len(steps), len(t)))
+    I = np.empty(len(steps))
+    for i, (step, axis) in enumerate(zip(steps, axes)):
+        Vm = LTR.get_trace('V(n001)').get_wave(step)
+        Vp = LTR.get_trace('V(n005)').get_wave(step)
+        accuracy[i] = np.interp(t, axis, accuracy_dB(Vp, Vm))
+        I[i] = np.abs(LTR.get_trace('I(vdd)').get_wave(step)[-1] * 1e6)
+
+    metrics = settling_metrics(t, accuracy, Asettle=Asettle)
+    metrics["I"] = I
+    metrics["P"] = I * ctx.vdd
+    return metrics
+
+def read_sweep_ac(filename, ctx=None):
+    """
+    read_ac_open metrics of the loaded open-loop circuit for every step.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_sweep_ac.raw"), traces=["V(Vinp)"])
+
+    f = np.abs(np.asarray(LTR.get_axis(LTR.get_steps()[0])))
+    Vip = _stack(LTR, "V(Vinp)")
+    Vip_dB = 20*np.log10(np.abs(Vip))
+    Vip_phase = np.unwrap(np.angle(Vip), axis=-1)
+
+    BW_ol, PM, GM, f_GM = open_loop_metrics(f, Vip_dB, Vip_phase)
+    return {"BW_ol": BW_ol * 1e-6, "PM": PM, "GM": GM, "f_GM": f_GM}
+
+def read_sweep_noise(filename, ctx=None):
+    """
+    read_onoise metrics for every step.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_sweep_noise.raw"), traces=["V(onoise)"])
+
+    f = np.asarray(LTR.get_axis(LTR.get_steps()[0]))
+    SNR, noise_rms_uV = noise_metrics(f, _stack(LTR, "V(onoise)"))
+    return {"SNR": SNR, "V_int": noise_rms_uV}
+
+sweep_readers = {
+    "tran": read_sweep_tran,
+    "ac": read_sweep_ac,
+    "noise": read_sweep_noise,
+}
+
+def evaluate_sweep(filename, points, simulate=True, parallel_sims=3, ctx=None):
+    """
+    Evaluates N design points with one stepped simulation per analysis instead
+    of N separate runs. Returns a dict of arrays with one entry per point: the
+    design parameters, the settling, open-loop AC and noise metrics, and the FOM.
+    """
+    ctx = ctx or default_context
+    columns = as_columns(points)
+
+    if simulate:
+        LTC = get_runner(ctx.sim_dir, parallel_sims=parallel_sims)
+        for analysis in sweep_circuits:
+            write_sweep(filename, columns, analysis, LTC=LTC, ctx=ctx)
+        LTC.wait_completion()
+
+    results = dict(columns)
+    for read in sweep_readers.values():
+        results |= read(filename, ctx=ctx)
+
+    results["FOM_lin"], results["FOM_dB"] = figure_of_merit(results["P"], results["tau_cl_tran"], results["SNR"])
+    return results
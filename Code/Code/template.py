@@ -0,0 +1,68 @@
+import os
+import re
+import threading
+
+# (template path, placeholder, keys) -> (mtime_ns, compiled parts)
+_compiled = {}
+_lock = threading.Lock()
+
+def _read(path):
+    # latin-1 round-trips any byte, the placeholders and values are ASCII
+    with open(path, "r", encoding="latin-1", newline="") as f:
+        return f.read()
+
+def compile_template(path, keys, placeholder="{}"):
+    """
+    Tokenises a template once into literal text and placeholder keys. The
+    placeholder pattern says how a key appears in the file, e.g. "__{}__" for
+    the LaTeX tables or "{}_V" for the schematic annotations. The compiled
+    form is cached until the template changes.
+    """
+    path = os.path.abspath(path)
+    keys = tuple(sorted(set(keys), key=len, reverse=True))
+    cache_key = (path, placeholder, keys)
+    mtime = os.stat(path).st_mtime_ns
+
+    with _lock:
+        entry = _compiled.get(cache_key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+    text = _read(path)
+    tokens = {placeholder.format(key): key for key in keys}
+    if tokens:
+        # Longest placeholders first, so no key matches inside a longer one
+        pattern = re.compile("|".join(re.escape(token) for token in tokens))
+        pieces = pattern.split(text)
+        found = [tokens[m] for m in pattern.findall(text)]
+    else:
+        pieces, found = [text], []
+    # Literal text at even positions, keys at odd positions
+    parts = [pieces[0]]
+    for key, literal in zip(found, pieces[1:]):
+        parts += [key, literal]
+    parts = tuple(parts)
+
+    with _lock:
+        _compiled[cache_key] = (mtime, parts)
+    return parts
+
+def render(path, values, placeholder="{}", out=None):
+    """
+    Fills the template at path with the already formatted strings in values in
+    one pass. Writes the result to out when given and returns it.
+    """
+    parts = compile_template(path, values, placeholder=placeholder)
+    text = "".join(values[part] if i % 2 else part for i, part in enumerate(parts))
+    if out is not None:
+        with open(out, "w", encoding="latin-1", newline="") as f:
+            f.write(text)
+    return text
+
+def render_batch(path, points, placeholder="{}"):
+    """
+    Renders one output file per design point from the same compiled template.
+    points is an iterable of (output path, values) pairs.
+    """
+    for out, values in points:
+        render(path, values, placeholder=placeholder, out=out)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+# Spans are cheap (two clock reads and an append), so tracing stays on
+enabled = True
+# Most recent spans kept for export
+max_events = 100000
+# Span names to profile with cProfile, True for every span that is not nested
+# in a profiled one. Profiles are written to profile_dir as <name>_<pid>_<n>.prof
+profile = ()
+profile_dir = None
+
+_events = deque(maxlen=max_events)
+_lock = threading.Lock()
+_local = threading.local()
+_profiles = 0
+
+def _recorders():
+    if not hasattr(_local, "recorders"):
+        _local.recorders = []
+    return _local.recorders
+
+def add_span(name, category, start, end, **args):
+    """
+    Records a finished span; start and end are time.perf_counter_ns() values.
+    """
+    if not enabled:
+        return
+    _append((name, category, start, end - start, os.getpid(), threading.get_ident(), args))
+
+def _append(event):
+    with _lock:
+        _events.append(event)
+    for recorder in _recorders():
+        recorder.append(event)
+
+def merge(spans):
+    """
+    Adds spans recorded in another process, e.g. a process-pool worker that
+    returned them from recording(), to this process's trace and the current
+    recordings. They keep the worker's pid and thread; perf_counter_ns is a
+    system-wide clock, so they line up with the local spans.
+    """
+    if not enabled:
+        return
+    for event in spans:
+        _append(event)
+
+def _profiler(name):
+    global _profiles
+    if not profile or profile_dir is None or getattr(_local, "profiling", False):
+        return None
+    if profile is not True and name not in profile:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another thread is profiling, only one profiler can be active at a time
+        return None
+    _local.profiling = True
+    with _lock:
+        _profiles += 1
+    return profiler
+
+@contextmanager
+def span(name, category="stage", **args):
+    """
+    Times the enclosed block as one span, profiled when name is selected in profile.
+    """
+    if not enabled:
+        yield
+        return
+    profiler = _profiler(name)
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        if profiler is not None:
+            profiler.disable()
+            _local.profiling = False
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, rf"{name}_{os.getpid()}_{_profiles}.prof"))
+        add_span(name, category, start, end, **args)
+
+def traced(category="stage", name=None):
+    """
+    Decorator wrapping every call of the function in a span.
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def recording():
+    """
+    Collects the spans the current thread finishes inside the block into the
+    yielded list, e.g. to summarise one evaluation.
+    """
+    spans = []
+    _recorders().append(spans)
+    try:
+        yield spans
+    finally:
+        _recorders().remove(spans)
+
+def summary(spans):
+    """
+    Total time in s and number of calls per span name.
+    """
+    totals = {}
+    for name, category, start, duration, pid, tid, args in spans:
+        total = totals.setdefault(name, {"time": 0.0, "calls": 0})
+        total["time"] += duration * 1e-9
+        total["calls"] += 1
+    return totals
+
+def events():
+    with _lock:
+        return list(_events)
+
+def clear():
+    with _lock:
+        _events.clear()
+
+def export_chrome(path, spans=None):
+    """
+    Writes the spans (all recorded ones by default) as a Chrome trace, to be
+    opened in chrome://tracing or Perfetto.
+    """
+    spans = events() if spans is None else spans
+    trace_events = [{
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start / 1e3,
+        "dur": duration / 1e3,
+        "pid": pid,
+        "tid": tid,
+        "args": {key: str(value) for key, value in args.items()},
+    } for name, category, start, duration, pid, tid, args in spans]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
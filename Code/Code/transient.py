@@ -1,25 +1,112 @@
-import pandas as pd
 import os
-import io
-import re
 import numpy as np
-import subprocess
-import shutil
-import ltspice
-import matplotlib.pyplot as plt
-import scienceplots
-from PyLTSpice import SimRunner
-from PyLTSpice import SpiceEditor
-from PyLTSpice import RawRead
-
-from src.ltspice_to_svg import main as lt_to_svg
+from .cache import run_cached
+from .context import default_context
+from .netlist import load_netlist
+from .simulator import get_runner
+from .rawfile import read_raw
+from .figures import figure
+from .trace import traced
 
 dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
 t_offset = 1 # us
 
-def read_transient(filename, T_settle = 10):
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_tran.raw"))
+# Maximum timestep of the transient. The settling times are interpolated
+# between samples, so this does not need to resolve tau_cl_tran directly.
+tran_max_step = 0.05e-6 # s
+# "linear" or "cubic" interpolation of the settling crossings
+interpolation = "cubic"
+
+def tran_directives(stop=100e-6, max_step=None):
+    max_step = max_step or tran_max_step
+    return (
+        "; Simulation settings",
+        rf".tran 0 {stop*1e6:g}u 0 {max_step*1e6:g}u",
+        ".save V(vop) V(n001) V(n005) V(von) V(n006) V(n002) I(vdd)",
+        ".options plotwinsize=0",
+    )
+
+tran_instructions = tran_directives()
+
+# Automatic stop time: stop_margin times the settling time predicted from the
+# closed-loop time constant, within [min_stop, max_stop]
+stop_margin = 3
+min_stop = 5e-6 # s
+max_stop = 100e-6 # s
+# Accuracy right after the input step, where the settling starts from
+A_step = 19.3 # dB
+
+def accuracy_dB(Vp, Vm):
+    return 20 * np.log10(1.2 / (np.abs(Vp-Vm) + 1e-9))
+
+def settling_crossings(t, accuracy, levels, kind=None):
+    """
+    Times at which accuracy finally rises through each level and stays above
+    it, interpolated between samples. accuracy is one trace or a 2-D array with
+    one trace per row on the time axis t; the result has a trailing axis with
+    one entry per level. A level the trace has not settled to by the end gives
+    the last time point.
+    """
+    kind = kind or interpolation
+    accuracy = np.asarray(accuracy, dtype=float)
+    t = np.broadcast_to(np.asarray(t, dtype=float), accuracy.shape)
+    levels = np.asarray(levels, dtype=float)
+    n = accuracy.shape[-1]
+
+    # Last sample below each level, for all levels at once: (..., levels, samples)
+    below = accuracy[..., None, :] < levels[:, None]
+    last = n - 1 - np.argmax(below[..., ::-1], axis=-1)
+    never_below = ~below.any(axis=-1)
+    settled = ~below[..., -1]
+    i = np.clip(last, 0, n - 2)
+
+    def at(values, index):
+        return np.take_along_axis(values[..., None, :], np.clip(index, 0, n - 1)[..., None], axis=-1)[..., 0]
+
+    t0, t1 = at(t, i), at(t, i + 1)
+    a0, a1 = at(accuracy, i), at(accuracy, i + 1)
+    level = np.broadcast_to(levels, a0.shape)
+    s = np.clip((level - a0) / np.where(a1 == a0, 1, a1 - a0), 0, 1)
+
+    if kind == "cubic":
+        # Cubic Hermite segment with finite-difference slopes, solved for the
+        # level with a few Newton steps from the linear estimate
+        dt = t1 - t0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope0 = np.where(i > 0, (a1 - at(accuracy, i - 1)) / (t1 - at(t, i - 1)) * dt, a1 - a0)
+            slope1 = np.where(i < n - 2, (at(accuracy, i + 2) - a0) / (at(t, i + 2) - t0) * dt, a1 - a0)
+        slope0 = np.where(np.isfinite(slope0), slope0, a1 - a0)
+        slope1 = np.where(np.isfinite(slope1), slope1, a1 - a0)
+        for _ in range(4):
+            h00, h10, h01, h11 = 2*s**3 - 3*s**2 + 1, s**3 - 2*s**2 + s, -2*s**3 + 3*s**2, s**3 - s**2
+            value = h00*a0 + h10*slope0 + h01*a1 + h11*slope1 - level
+            derivative = (6*s**2 - 6*s)*a0 + (3*s**2 - 4*s + 1)*slope0 + (-6*s**2 + 6*s)*a1 + (3*s**2 - 2*s)*slope1
+            s = np.clip(s - value / np.where(derivative == 0, np.inf, derivative), 0, 1)
+
+    crossing = t0 + s * (t1 - t0)
+    crossing = np.where(never_below, t[..., :1], crossing)
+    return np.where(settled, crossing, t[..., -1:])
+
+def settling_metrics(t, accuracy, Asettle=57, kind=None):
+    """
+    T_48dB, T_40dB, T_settle and tau_cl_tran in us, relative to the input step.
+    accuracy is one trace or a 2-D array with one trace per row on the time axis t.
+    """
+    crossings = settling_crossings(t, accuracy, (48.69, 40, Asettle), kind=kind) - t_offset
+    T_48dB, T_40dB, T_settle = np.moveaxis(crossings, -1, 0)
+
+    return {
+        "T_48dB": T_48dB,
+        "T_40dB": T_40dB,
+        "T_settle": T_settle,
+        "tau_cl_tran" : T_48dB - T_40dB,
+    }
+
+@traced("read")
+def read_transient(filename, T_settle = 10, ctx=None, render=True):
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_tran.raw"), traces=["V(vop)", "V(von)", "V(n006)", "V(n002)", "I(vdd)"])
     
     t = LTR.get_axis()  * 1e6
     Vop = LTR.get_trace('V(vop)')
@@ -28,107 +115,84 @@ def read_transient(filename, T_settle = 10):
     Vin = LTR.get_trace('V(n002)')
     Ivdd = LTR.get_trace('I(vdd)')
 
-    fig, ax = plt.subplots(2,1, figsize=(7,7))
-    ax[0].plot(t, Vip, label="$V_{ip}$")
-    ax[0].plot(t, Vin, label="$V_{in}$")
-    ax[1].plot(t, Vop, label="$V_{op}$")
-    ax[1].plot(t, Von, label="$V_{on}$")
-    
-    for axx in ax:
-        axx.set_xlabel("Time [$\mu$s]")
-        axx.set_ylabel("Voltage [V]")
-        axx.set_xlim(xmax=T_settle+5, xmin=0)
-
-    plt.tight_layout()
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_tran.pdf"), transparent = True)
+    if render:
+        figure(render, "transient", [ctx.fig(rf"{filename}_tran.pdf")], t=t, Vip=Vip, Vin=Vin, Vop=Vop, Von=Von, T_settle=T_settle)
 
     return np.abs(Ivdd[-1] * 1e6)
 
-def virtual_ground_settling(filename, Asettle=57):
-    LTR = RawRead(os.path.join(dir_path, "Simulations", rf"{filename}_tran.raw"))
+@traced("read")
+def virtual_ground_settling(filename, Asettle=57, ctx=None, render=True):
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_tran.raw"), traces=["V(n001)", "V(n005)"])
     t = LTR.get_axis() * 1e6
     Vm = LTR.get_trace('V(n001)').get_wave()
     Vp = LTR.get_trace('V(n005)').get_wave()
-    Ivdd = LTR.get_trace('I(vdd)')
-
-    accuracy = 20 * np.log10(1.2 / (np.abs(Vp-Vm) + 1e-9))
 
-    fig, ax = plt.subplots(figsize=(7,4))
-    ax.plot(t, accuracy)
-    # ax.plot(t, np.abs(Virground-Virground[0]))
-    ax.set_xlabel("Time [$\mu$s]")
-    ax.set_ylabel("Accuracy [dB]")
-    ax.set_ylim(ymax=accuracy[-1]*1.1)
+    accuracy = accuracy_dB(Vp, Vm)
 
+    parameters = settling_metrics(t, accuracy, Asettle=Asettle)
 
-
-    T_48dB = t[np.argmin(np.abs(accuracy - 48.69))] - t_offset
-    T_40dB = t[np.argmin(np.abs(accuracy - 40))] - t_offset
-    T_settle = t[np.argmin(np.abs(accuracy - Asettle))] - t_offset
-    tau_cl_tran = T_48dB - T_40dB 
-
-    parameters = {
-        "T_48dB": T_48dB,
-        "T_40dB": T_40dB,
-        "T_settle": T_settle,
-        "tau_cl_tran" : tau_cl_tran,
-    }
-
-    ax.set_xlim(xmax=T_settle+4, xmin=-0.1*(T_settle+4))
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_settling.pdf"), transparent=True)
-
-    ax.hlines([48.69, 40, Asettle], xmin=t[0], xmax=T_settle*1.1+t_offset)
-
-
-    ax.vlines(T_48dB+t_offset, ymax=48.69, ymin=np.min(accuracy))
-    ax.vlines(T_40dB+t_offset, ymax=40, ymin=np.min(accuracy))
-    ax.vlines(T_settle+t_offset, ymax=Asettle, ymin=np.min(accuracy))
-
-    for i in [T_48dB, T_40dB, T_settle]:
-        ax.annotate(rf"{i:.2f}$\mu s$", (i+t_offset, np.min(accuracy)-1), ha='center', va = "top")
-    for i in [48.69, 40, Asettle]:
-        ax.annotate(rf"{i:.2f}", (-0.25, i), ha='right', va='center')
-
-    y_pos = np.min(accuracy)+5
-    ax.annotate(
-        '',                      
-        xy=(T_40dB+t_offset, y_pos),      
-        xytext=(T_48dB+t_offset, y_pos), 
-        arrowprops=dict(arrowstyle="<->")
-    )
-    ax.annotate(
-        rf'$\tau_{{cl}}$',
-        ((T_40dB + T_48dB) / 2+t_offset, y_pos+1), 
-        ha='center',
-        va='bottom'
-    )
-    ax.annotate(
-        rf'{tau_cl_tran:.3f}',
-        ((T_40dB + T_48dB) / 2+t_offset, y_pos-1), 
-        ha='center',
-        va='top'
-    )
-
-
-    fig.savefig(os.path.join(dir_path, "Figures", rf"{filename}_settling_annotated.pdf"), transparent=True)
+    if render:
+        figure(render, "settling", [ctx.fig(rf"{filename}_settling.pdf"), ctx.fig(rf"{filename}_settling_annotated.pdf")],
+               t=t, accuracy=accuracy, Asettle=Asettle, t_offset=t_offset, **parameters)
 
     return parameters
     
 
-def write_transient(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1):
-    LTC = SimRunner(output_folder=os.path.join(dir_path, "Simulations"))
-    LTC.create_netlist(os.path.join(dir_path, "Circuits", rf"{filename}.asc"))
-    netlist = SpiceEditor(os.path.join(dir_path, "Circuits", rf"{filename}.net"))
+@traced("write")
+def write_transient(filename, Rbn=4.8, Rbp=6.2, Sa=2.5, Rmp=5, R34=3, Ibmain=200e-6, Cin=1e-8, Sa_b=1, stop=100e-6, max_step=None, LTC=None, ctx=None):
+    ctx = ctx or default_context
+    wait = LTC is None
+    if wait:
+        LTC = get_runner(ctx.sim_dir)
+    netlist = load_netlist(ctx.circuit(rf"{filename}.asc"), LTC, corner=ctx.corner)
 
     netlist.set_parameters(Rbn=Rbn, Rbp=Rbp, Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
 
-    netlist.add_instructions(
-    "; Simulation settings",
-    ".tran 0 100u 0 0.005u",
-    ".save V(vop) V(n001) V(n005) V(von) V(n006) V(n002) I(vdd)",
-    ".options plotwinsize=0",
-    )
+    netlist.add_instructions(*tran_directives(stop=stop, max_step=max_step))
 
     
-    LTC.run(netlist, run_filename="closed_loop_tran")
-    LTC.wait_completion(2)
\ No newline at end of file
+    cached = run_cached(LTC, netlist, "closed_loop_tran")
+    if wait:
+        LTC.wait_completion(2)
+    return cached
+
+def transient_stop(tau_cl, Asettle=57):
+    """
+    Transient stop time in s for a closed-loop time constant tau_cl in us. A
+    single-pole response needs ln(10)*(Asettle-A_step)/20 time constants to
+    settle to Asettle.
+    """
+    T_settle = tau_cl * 1e-6 * np.log(10) * (Asettle - A_step) / 20
+    return float(np.clip(t_offset*1e-6 + stop_margin * T_settle, min_stop, max_stop))
+
+def is_settled(filename, stop, Asettle=57, ctx=None):
+    """
+    True when the accuracy reached Asettle and held it over the last part of
+    the run, so a longer transient would not change T_settle.
+    """
+    ctx = ctx or default_context
+    LTR = read_raw(ctx.sim(rf"{filename}_tran.raw"), traces=["V(n001)", "V(n005)"])
+    t = LTR.get_axis() * 1e6
+    accuracy = accuracy_dB(LTR.get_trace('V(n005)').get_wave(), LTR.get_trace('V(n001)').get_wave())
+    T_settle = settling_metrics(t, accuracy, Asettle=Asettle)["T_settle"]
+    return accuracy[-1] >= Asettle and T_settle + t_offset < (1 - 1/stop_margin) * stop * 1e6
+
+@traced("write")
+def write_transient_auto(filename, tau_cl, Asettle=57, ctx=None, **parameters):
+    """
+    Runs the transient with a stop time sized from tau_cl and doubles it until
+    the accuracy settled to Asettle or max_stop is reached. Returns the stop
+    time used.
+    """
+    ctx = ctx or default_context
+    stop = transient_stop(tau_cl, Asettle=Asettle)
+    LTC = get_runner(ctx.sim_dir)
+    while True:
+        write_transient(filename, stop=stop, LTC=LTC, ctx=ctx, **parameters)
+        # is_settled has to see this run's raw file, not the previous shorter one
+        LTC.wait_completion()
+        if stop >= max_stop or is_settled(filename, stop, Asettle=Asettle, ctx=ctx):
+            return stop
+        print(rf"Not settled to {Asettle} dB in {stop*1e6:g} us, extending")
+        stop = min(2*stop, max_stop)
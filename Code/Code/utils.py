@@ -1,18 +1,14 @@
-import pandas as pd
 import os
-import io
 import re
 import numpy as np
 import subprocess
 import shutil
-import ltspice
-import matplotlib.pyplot as plt
-import scienceplots
 import warnings
-# plt.style.use(['science','ieee'])
+from .trace import traced
 
+dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# plt.style.use(['science','ieee'])
 
-from src.ltspice_to_svg import main as lt_to_svg
 
 def optimize_svg(path):
     # Run the SVGO command if SVGO is installed
@@ -20,8 +16,9 @@ def optimize_svg(path):
         subprocess.run([shutil.which("svgo"), path])
 
 def save_schematic(filename):
+    from src.ltspice_to_svg import main as lt_to_svg
     filename = filename.split(".asc")[0]
-    file_path = os.path.join(dir_path, rf"{filename}.asc")
+    file_path = os.path.join(dir_path, "Circuits", rf"{filename}.asc")
 
     lt_to_svg([
     rf"{file_path}", 
@@ -30,24 +27,41 @@ def save_schematic(filename):
     "--font-family", "Times New Roman",
     ])
 
-    optimize_svg(os.path.join(dir_path, rf"{filename}.svg"))
+    optimize_svg(os.path.join(dir_path, "Circuits", rf"{filename}.svg"))
+
+def figure_of_merit(P, tau_cl_tran, SNR):
+    # P in uW and tau_cl_tran in us; returns FOM_lin in aJ and FOM_dB
+    FOM_lin = 2 * np.pi * P * 1e-6 * tau_cl_tran * 1e-6 / (10**(SNR/20))**2
+    FOM_dB = -10 * np.log10(FOM_lin)
+    return FOM_lin * 1e18, FOM_dB
+
+@traced("latex")
+def _needs_rerun(log_file):
+    # LaTeX asks for another pass when labels or outlines changed
+    if not os.path.isfile(log_file):
+        return False
+    with open(log_file, errors="ignore") as f:
+        return "Rerun to get" in f.read()
 
-def compileLatex(dir_path, tex_name):
+def compileLatex(dir_path, tex_name, max_passes=3):
     if tex_name.split(".")[-1] == 'tex':
         raise ValueError("Do not provide the .tex extension of the file")
     
     print("COMPILING LATEX")
     if shutil.which("pdflatex") is not None:
-        subprocess.run([
-            "pdflatex",
-            "--max-print-line=10000",
-            "-synctex=1",
-            "-shell-escape",
-            "-interaction=nonstopmode",
-            "-file-line-error",
-            "-recorder",
-            rf"{tex_name}.tex"
-        ], cwd=dir_path)
+        for _ in range(max_passes):
+            subprocess.run([
+                "pdflatex",
+                "--max-print-line=10000",
+                "-synctex=1",
+                "-shell-escape",
+                "-interaction=nonstopmode",
+                "-file-line-error",
+                "-recorder",
+                rf"{tex_name}.tex"
+            ], cwd=dir_path)
+            if not _needs_rerun(os.path.join(dir_path, rf"{tex_name}.log")):
+                break
         if shutil.which("gs") is not None:
             temp_out = f"{tex_name}_temp.pdf"
             subprocess.run([
@@ -79,4 +93,28 @@ def compileLatex(dir_path, tex_name):
         else:
             warnings.warn("ghostscript not installed, can't compress pdf")
     else:
-        warnings.warn("pdflatex not found in PATH, can't compile latex automatically")
\ No newline at end of file
+        warnings.warn("pdflatex not found in PATH, can't compile latex automatically")
+
+def spice_to_dict(param_str):
+    # Dictionary of Spice multipliers
+    multipliers = {
+        't': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3, 
+        'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15
+    }
+    
+    # Extract key=value pairs using Regex
+    # Matches patterns like Ibmain=28.05u
+    matches = re.findall(r'(\w+)=([\d\.]+)([a-zA-Z]*)', param_str)
+    
+    results = {}
+    for key, val, unit in matches:
+        value = float(val)
+        unit = unit.lower()
+        
+        # Apply multiplier if it exists
+        if unit in multipliers:
+            value *= multipliers[unit]
+            
+        results[key] = value
+    print(results)
+    return results
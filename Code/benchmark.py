@@ -0,0 +1,290 @@
+from Code.context import RunContext
+from Code.rawfile import read_raw, forget
+from Code.transient import virtual_ground_settling, tran_instructions, read_transient
+from Code.ac import read_ac_open, closed_loop_from_open
+from Code.onoise import read_onoise
+from Code.operating_point import read_operating_point, annotate_voltages, annotate_currents, clear as clear_op_tables
+from Code.template import render
+from Code.cache import netlist_text
+from Code.figures import RenderQueue, render_figure
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import matplotlib
+from PyLTSpice import SpiceEditor, RawRead
+
+# Benchmark of the processing pipeline on synthetic LTspice fixtures. Nothing
+# is simulated, so it runs without LTspice:
+#
+#   python benchmark.py --tran-points 200000 --ac-points 2000 --devices 200
+#   python benchmark.py --save-baseline
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+baseline_file = os.path.join(dir_path, "benchmark_baseline.json")
+
+filename = "closed_loop"
+
+# A stage is reported slower when it takes more than this fraction longer than the baseline
+tolerance = 0.2
+
+def write_raw(path, plotname, flags, variables, n_points):
+    """
+    Binary LTspice raw file. variables is a list of (name, type, values) with
+    the axis first. Real files store the axis as float64 and the traces as
+    float32, complex files store everything as complex128.
+    """
+    header = [
+        "Title: * benchmark fixture",
+        rf"Date: {time.ctime()}",
+        rf"Plotname: {plotname}",
+        rf"Flags: {flags}",
+        rf"No. Variables: {len(variables)}",
+        rf"No. Points: {n_points}",
+        "Offset:   0.0000000000000000e+000",
+        "Command: Linear Technology Corporation LTspice XVII",
+        "Variables:",
+    ]
+    header += [f"\t{i}\t{name}\t{kind}" for i, (name, kind, _) in enumerate(variables)]
+    header += ["Binary:", ""]
+
+    if "complex" in flags.split():
+        types = ["<c16"] * len(variables)
+    elif "double" in flags.split():
+        types = ["<f8"] * len(variables)
+    else:
+        types = ["<f8"] + ["<f4"] * (len(variables) - 1)
+    records = np.empty(n_points, dtype=[(rf"v{i}", t) for i, t in enumerate(types)])
+    for i, (_, _, values) in enumerate(variables):
+        records[rf"v{i}"] = values
+
+    with open(path, "wb") as f:
+        f.write("\n".join(header).encode("utf-16-le"))
+        f.write(records.tobytes())
+
+def transient_fixture(ctx, n_points, tau=0.25e-6, stop=20e-6):
+    # Input step at t_offset, virtual-ground error decaying from A_step with tau
+    t = np.linspace(0, stop, n_points)
+    after = t >= 1e-6
+    error = np.where(after, 0.13 * np.exp(-np.clip(t - 1e-6, 0, None) / tau), 0)
+    output = np.where(after, 0.6 * (1 - np.exp(-np.clip(t - 1e-6, 0, None) / tau)), 0)
+    step = np.where(after, 0.075, 0)
+    write_raw(ctx.sim(rf"{filename}_tran.raw"), "Transient Analysis", "real forward", [
+        ("time", "time", t),
+        ("V(n001)", "voltage", 0.9 + error/2),
+        ("V(n005)", "voltage", 0.9 - error/2),
+        ("V(vop)", "voltage", 0.9 + output),
+        ("V(von)", "voltage", 0.9 - output),
+        ("V(n006)", "voltage", 0.9 + step),
+        ("V(n002)", "voltage", 0.9 - step),
+        ("I(vdd)", "device_current", np.full(n_points, -200e-6)),
+    ], n_points)
+
+def ac_fixture(ctx, n_points, load="loaded"):
+    # Two-pole loop gain and a closed-loop gain of -8
+    f = np.logspace(1, 10, n_points)
+    s = 2j * np.pi * f
+    loop_gain = 1e4 / ((1 + s / (2*np.pi*1e3)) * (1 + s / (2*np.pi*2e8)))
+    write_raw(ctx.sim(rf"{filename}_{load}_ac.raw"), "AC Analysis", "complex forward log", [
+        ("frequency", "frequency", f),
+        ("V(vo)", "voltage", -7 * loop_gain),
+        ("V(vinp)", "voltage", loop_gain),
+    ], n_points)
+
+def noise_fixture(ctx, n_points):
+    f = np.logspace(4, 11, n_points)
+    write_raw(ctx.sim(rf"{filename}_noise.raw"), "Noise Spectral Density - (V/Hz½) at V(Vo)", "real forward log", [
+        ("frequency", "frequency", f),
+        ("V(onoise)", "voltage", 5e-9 / np.sqrt(1 + (f / 1e7)**2)),
+    ], n_points)
+
+# Nodes annotate_voltages reads from the operating point
+op_nodes = ("n003", "n005", "n001", "vop", "von", "x1:vbp", "x1:vsp", "x1:vcp", "x1:vcn", "x1:vsn", "x1:vbn",
+            "x1:vsi", "x1:vssi", "x1:vbcm", "x1:vpml", "x1:vpmr", "x1:vpg", "x1:vnml", "x1:vnmr")
+# Devices annotate_currents reads
+op_devices = ("n2", "n3", "n4", "n5", "n7", "p1", "p3")
+
+def op_fixture(ctx, n_devices, columns=8):
+    write_raw(ctx.sim(rf"{filename}_op.raw"), "Operating Point", "real double", [
+        (rf"V({node})", "voltage", [0.9]) for node in op_nodes
+    ], 1)
+
+    devices = list(op_devices) + [rf"xx1:m{i}" for i in range(max(n_devices - len(op_devices), 0))]
+    devices = [rf"m:x1:{device}" for device in devices]
+    quantities = {"Id": 1e-4, "Vgs": 0.7, "Vds": 0.5, "Vbs": 0.0, "Vth": 0.45, "Vdsat": 0.2, "Gm": 1e-3, "Gds": 1e-5, "Gmb": 2e-4}
+
+    lines = ["Circuit: * benchmark fixture", "", "Semiconductor Device Operating Points:", "", "                     --- BSIM3 MOSFETS ---"]
+    for i in range(0, len(devices), columns):
+        block = devices[i:i+columns]
+        lines.append("Name:    " + "".join(rf"{d:>16}" for d in block))
+        lines.append("Model:   " + "".join(rf"{('pch' if 'p' in d.split(':')[-1] else 'nch'):>16}" for d in block))
+        for key, value in quantities.items():
+            lines.append(rf"{key + ':':<9}" + "".join(rf"{value * (1 + 1e-3*j):>16.2e}" for j in range(len(block))))
+        lines.append("")
+    lines += [rf"Date: {time.ctime()}", "Total elapsed time: 0.1 seconds."]
+
+    with open(ctx.sim(rf"{filename}_op.log"), "w", encoding="utf-16-le") as f:
+        f.write("\n".join(lines) + "\n")
+
+def netlist_fixture(ctx, n_devices):
+    # The repository's transient netlist with n_devices extra MOSFETs in the op amp
+    with open(os.path.join(dir_path, "Simulations", "closed_loop_tran"), encoding="latin-1") as f:
+        text = f.read()
+    devices = "".join(rf"Mb{i} Vo- Vpg Vpmr Vdd pch l={{L}} w={{W}} m={{Sa*Rmp*2}}" + "\n" for i in range(n_devices))
+    text = text.replace(".ends op_amp", devices + ".ends op_amp", 1)
+    path = ctx.sim(rf"{filename}_benchmark.net")
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(text)
+    return path
+
+def make_fixtures(ctx, tran_points, ac_points, noise_points, devices):
+    transient_fixture(ctx, tran_points)
+    ac_fixture(ctx, ac_points)
+    noise_fixture(ctx, noise_points)
+    op_fixture(ctx, devices)
+    return netlist_fixture(ctx, devices)
+
+def table_values():
+    keys = ("SNR", "T_settle", "BW_ol", "BW_cl", "tau_cl", "T_40dB", "T_48dB", "tau_cl_tran", "P", "I", "V_int",
+            "Cin", "Cfb", "Cload", "Ccm", "FOM_lin", "FOM_dB")
+    return {key: rf"{1.234:.3f}" for key in keys}
+
+def stages(ctx, net_file):
+    """
+    Stage name -> function. Every stage starts cold: the raw-file registry and
+    the operating-point memo are emptied before each call.
+    """
+    figures = RenderQueue()
+
+    def netlist():
+        editor = SpiceEditor(net_file)
+        editor.set_parameters(Sa=3.5, R34=3, Rmp=5, Ibmain=200e-6, Cin=5e-12, Sa_b=1)
+        editor.add_instructions(*tran_instructions)
+        netlist_text(editor)
+
+    def raw_rawread():
+        RawRead(ctx.sim(rf"{filename}_tran.raw"))
+
+    def raw_memmap():
+        LTR = read_raw(ctx.sim(rf"{filename}_tran.raw"), traces=["V(n001)", "V(n005)", "I(vdd)"])
+        np.asarray(LTR.get_trace("V(n001)")).sum()
+
+    def templates():
+        annotate_voltages(filename, "op_amp", ctx=ctx)
+        annotate_currents(filename, "op_amp", ctx=ctx)
+        render(ctx.template("result_table_template.tex"), table_values(), placeholder="__{}__", out=ctx.fig("result_table.tex"))
+
+    def figure_output():
+        for kind, paths, data in figures.jobs:
+            render_figure(kind, paths, data)
+
+    # The figures are drawn from the data the readers pass on, collected once
+    parameters = virtual_ground_settling(filename, ctx=ctx, render=figures)
+    read_transient(filename, T_settle=float(parameters["T_settle"]), ctx=ctx, render=figures)
+    read_ac_open(filename, load="loaded", ctx=ctx, render=figures)
+    closed_loop_from_open(filename, ctx=ctx, render=figures)
+    read_onoise(filename, ctx=ctx, render=figures)
+
+    return {
+        "netlist": netlist,
+        "raw_rawread": raw_rawread,
+        "raw_memmap": raw_memmap,
+        "virtual_ground_settling": lambda: virtual_ground_settling(filename, ctx=ctx, render=False),
+        "read_ac_open": lambda: read_ac_open(filename, load="loaded", ctx=ctx, render=False),
+        "closed_loop_from_open": lambda: closed_loop_from_open(filename, ctx=ctx, render=False),
+        "read_onoise": lambda: read_onoise(filename, ctx=ctx, render=False),
+        "read_operating_point": lambda: read_operating_point(filename, save=True, ctx=ctx),
+        "templates": templates,
+        "figures": figure_output,
+    }
+
+def measure(stage, repeat):
+    """
+    Best and median wall time in s over repeat runs, then the peak of the
+    Python allocations in MiB from one extra run under tracemalloc.
+    """
+    times = []
+    for _ in range(repeat):
+        forget()
+        clear_op_tables()
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+
+    forget()
+    clear_op_tables()
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "median": float(np.median(times)), "peak_MiB": peak / 2**20}
+
+def configuration(args):
+    return rf"tran={args.tran_points},ac={args.ac_points},noise={args.noise_points},devices={args.devices}"
+
+def compare(results, baseline):
+    """
+    Prints every stage against the baseline; returns the stages that got slower.
+    """
+    slower = []
+    print(rf"{'stage':<26}{'time [ms]':>12}{'median [ms]':>13}{'peak [MiB]':>12}{'baseline':>12}{'ratio':>8}")
+    for name, result in results.items():
+        line = rf"{name:<26}{result['time']*1e3:>12.2f}{result['median']*1e3:>13.2f}{result['peak_MiB']:>12.2f}"
+        reference = baseline.get(name)
+        if reference is not None:
+            ratio = result["time"] / reference["time"]
+            line += rf"{reference['time']*1e3:>12.2f}{ratio:>8.2f}"
+            if ratio > 1 + tolerance:
+                line += "  SLOWER"
+                slower.append(name)
+        print(line)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the processing pipeline on synthetic fixtures")
+    parser.add_argument("--tran-points", type=int, default=100000)
+    parser.add_argument("--ac-points", type=int, default=1000)
+    parser.add_argument("--noise-points", type=int, default=1000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", nargs="*", help="only run these stages")
+    parser.add_argument("--baseline", default=baseline_file)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline of this configuration")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    matplotlib.use("Agg")
+    with RunContext(name="benchmark") as ctx:
+        net_file = make_fixtures(ctx, args.tran_points, args.ac_points, args.noise_points, args.devices)
+        results = {}
+        for name, stage in stages(ctx, net_file).items():
+            if args.stages and name not in args.stages:
+                continue
+            results[name] = measure(stage, args.repeat)
+
+    key = configuration(args)
+    baselines = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    print(rf"Configuration {key}")
+    slower = compare(results, baselines.get(key, {}))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({key: results}, f, indent=1)
+    if args.save_baseline:
+        baselines[key] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print(rf"Baseline saved to {args.baseline}")
+    return 1 if slower and not args.save_baseline else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,43 +1,47 @@
-from Code.operating_point import read_operating_point, write_operating_point, save_schematic, annotate_voltages, annotate_currents
-from Code.transient import write_transient, read_transient, virtual_ground_settling
-from Code.ac import write_ac_closed, read_ac_closed, write_ac_open, read_ac_open, closed_loop_from_open
+from Code.operating_point import read_operating_point, write_operating_point, annotate_voltages, annotate_currents
+from Code.transient import write_transient, read_transient, virtual_ground_settling, write_transient_auto
+from Code.ac import write_ac_closed, read_ac_closed, write_ac_open, read_ac_open, closed_loop_from_open, closed_loop_response, refine_ac_closed, refine_ac_open
+from Code.surrogate import fit_closed_loop, surrogate_accuracy
 from Code.onoise import read_onoise, write_onoise
-from Code.utils import compileLatex
+from Code.figures import RenderQueue
+from Code.template import render
+from Code.corners import corner_matrix, corner_name, tidy, worst_case
+from Code.utils import figure_of_merit, spice_to_dict
+from Code.report import build_report
+from Code.cache import run_cached
+from Code.store import record, lookup, history
+from Code.trace import span, traced, recording, summary, add_span, merge, export_chrome
+from Code.context import RunContext, default_context
+from Code.simulator import get_runner
+from Code.netlist import load_netlist
+from Code.sweep import evaluate_sweep, sweep_parameters
+from Code.doe import space as design_space, read_param_file, read_csv, latin_hypercube, full_factorial, pending_points, append_result
+from Code.store import parameters as ml_parameters
 import os 
 import shutil
-import re
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import partial
 import numpy as np
-from skopt import gp_minimize
-from skopt.space import Real
-from PyLTSpice import SimRunner
-from PyLTSpice import SpiceEditor
-from PyLTSpice import LTSpiceLogReader
-import matplotlib.pyplot as plt
-import scienceplots
-from skopt.callbacks import CheckpointSaver
-from skopt import load
-plt.style.use(['science','ieee', 'no-latex'])
-
+# skopt, PyLTSpice and matplotlib are imported where they are used, so that
+# importing this module (as the process-pool workers do) stays cheap
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 filename="closed_loop"
 
-def write_table(filename, parameters):
-    template_file = os.path.join(dir_path, "Figures", rf"{filename}_template.tex")
-    goal_file = os.path.join(dir_path, "Figures", rf"{filename}.tex")
-    shutil.copy(template_file, goal_file)
+def write_table(filename, parameters, ctx=None):
+    ctx = ctx or default_context
+    template_file = ctx.template(rf"{filename}_template.tex")
+    goal_file = ctx.fig(rf"{filename}.tex")
 
-    with open(goal_file, 'r+') as f:
-        file_data = f.read()
-        for name, data in parameters.items():
-            file_data = re.sub(rf"__{name}__", rf"{data:.3f}", file_data)
-        f.seek(0)
-        f.write(file_data)
-        f.truncate()
+    values = {name: rf"{data:.3f}" for name, data in parameters.items()}
+    render(template_file, values, placeholder="__{}__", out=goal_file)
 
-def write_final_values(filename, Sa, R34, Rmp, Ibmain, Cin, Sa_b):
-    filepath = os.path.join(dir_path, "Figures", filename)
+def write_final_values(filename, Sa, R34, Rmp, Ibmain, Cin, Sa_b, ctx=None):
+    ctx = ctx or default_context
+    filepath = ctx.fig(filename)
 
     with open(filepath, 'w') as f:
         f.write(rf"""
@@ -53,162 +57,439 @@ def write_final_values(filename, Sa, R34, Rmp, Ibmain, Cin, Sa_b):
 \end{{equation}}
 """)
 
-def evaluate_all(filename, Sa=3.5, R34=3, Rmp=5, Ibmain=200e-6, Cin=5e-12, Sa_b=1, simulate=False):
-    parameters = {}
-    parameters["Cin"]=Cin *1e12
-    parameters["Cfb"]=Cin/8 * 1e12
-    parameters["Ccm"]=Cin/8 * 1e12
-    parameters["Cload"]=Cin * 1e12
-
-    # OPERATING POINT
+def read_op_stage(filename, parameters, ctx, render=True):
     print("-----------------------")
     print("Operating point")
     print("-----------------------")
-    if simulate: write_operating_point(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-    read_operating_point(filename)
-    annotate_voltages(filename, "op_amp")
-    annotate_currents(filename, "op_amp")
+    read_operating_point(filename, save=bool(render), ctx=ctx)
+    if render:
+        annotate_voltages(filename, "op_amp", ctx=ctx)
+        annotate_currents(filename, "op_amp", ctx=ctx)
 
-    # TRANSIENT
+def read_tran_stage(filename, parameters, ctx, render=True):
     print("-----------------------")
     print("Transient")
     print("-----------------------")
-    if simulate: write_transient(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-    vground_parameters = virtual_ground_settling(filename)
-    parameters = vground_parameters | parameters
-    I = read_transient(filename, T_settle = parameters["T_settle"])
+    vground_parameters = virtual_ground_settling(filename, ctx=ctx, render=render)
+    parameters |= vground_parameters
+    I = read_transient(filename, T_settle = parameters["T_settle"], ctx=ctx, render=render)
     parameters["I"] = I
-    P = I * 1.8
+    P = I * ctx.vdd
     parameters["P"] = P
 
-
-    # AC closed
+def read_ac_closed_stage(filename, parameters, ctx, render=True):
     print("-----------------------")
     print("AC closed")
     print("-----------------------")
-    if simulate: write_ac_closed(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-    BW_cl, tau_cl = read_ac_closed(filename)
+    BW_cl, tau_cl = read_ac_closed(filename, ctx=ctx, render=render)
     parameters["BW_cl"] = BW_cl * 1e-6
     parameters["tau_cl"] = tau_cl
 
+def read_ac_unloaded_stage(filename, parameters, ctx, render=True):
+    print("-----------------------")
+    print("AC open (unloaded)")
+    print("-----------------------")
+    _ = read_ac_open(filename, load="unloaded", ctx=ctx, render=render)
+
+def read_ac_loaded_stage(filename, parameters, ctx, render=True):
     print("-----------------------")
-    print("AC open")
+    print("AC open (loaded)")
     print("-----------------------")
-    if simulate: write_ac_open(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, load="unloaded")
-    _ = read_ac_open(filename, load="unloaded")
-    if simulate: write_ac_open(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, load="loaded")
-    BW_ol = read_ac_open(filename, load="loaded")
-    closed_loop_from_open(filename)
+    BW_ol = read_ac_open(filename, load="loaded", ctx=ctx, render=render)
+    closed_loop_from_open(filename, ctx=ctx, render=render)
     parameters["BW_ol"] = BW_ol * 1e-6
 
-    # NOISE
+def read_noise_stage(filename, parameters, ctx, render=True):
     print("-----------------------")
     print("Noise")
     print("-----------------------")
-    if simulate: write_onoise(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-    SNR, int_noise = read_onoise(filename)
+    SNR, int_noise = read_onoise(filename, ctx=ctx, render=render)
     parameters["SNR"] = SNR
     parameters["V_int"] = int_noise
-    FOM_lin = 2 * np.pi * P * 1e-6 * parameters["tau_cl_tran"] * 1e-6 / (10**(SNR/20))**2
-    FOM_dB = -10 * np.log10(FOM_lin)
-    parameters["FOM_lin"] = FOM_lin * 1e18
-    parameters["FOM_dB"] = FOM_dB
+
+def analyses(filename):
+    # (run_filename, write function, extra write arguments, read stage), in report order
+    return [
+        ("closed_loop_op", write_operating_point, {}, read_op_stage),
+        ("closed_loop_tran", write_transient, {}, read_tran_stage),
+        ("closed_loop_ac", write_ac_closed, {}, read_ac_closed_stage),
+        (rf"{filename}_unloaded_ac", write_ac_open, {"load": "unloaded"}, read_ac_unloaded_stage),
+        (rf"{filename}_loaded_ac", write_ac_open, {"load": "loaded"}, read_ac_loaded_stage),
+        ("closed_loop_noise", write_onoise, {}, read_noise_stage),
+    ]
+
+def simulate_parallel(filename, design, parameters, parallel_sims=6, ctx=default_context, render=True, done=()):
+    """
+    Submits every analysis netlist to one shared runner and runs the matching
+    read stage as soon as its raw file is written. Runs listed in done were
+    already simulated and are only read.
+    """
+    LTC = get_runner(ctx.sim_dir, parallel_sims=parallel_sims)
+
+    pending = {}
+    submitted = {}
+    for run_filename, write, kwargs, read in analyses(filename):
+        if run_filename in done or write(filename, **design, **kwargs, LTC=LTC, ctx=ctx):
+            # Served from the simulation cache, nothing was submitted
+            read(filename, parameters, ctx, render)
+        else:
+            pending[run_filename] = read
+            submitted[run_filename] = time.perf_counter_ns()
+
+    for result in LTC:
+        if result is None:
+            continue
+        raw_file, log_file = result
+        run_filename = os.path.splitext(os.path.basename(raw_file))[0]
+        if run_filename in submitted:
+            # From submission to the raw file, the simulations overlap
+            add_span(run_filename, "simulate", submitted[run_filename], time.perf_counter_ns())
+        read = pending.pop(run_filename, None)
+        if read is not None:
+            read(filename, parameters, ctx, render)
+
+    if pending:
+        raise RuntimeError(rf"Simulations did not complete: {', '.join(pending)}")
+
+@traced("evaluation")
+def evaluate_all(filename, Sa=3.5, R34=3, Rmp=5, Ibmain=200e-6, Cin=5e-12, Sa_b=1, simulate=False, parallel_sims=None, ctx=None, render=True, adaptive_ac=False, auto_stop=False):
+    ctx = ctx or default_context
+    parameters = {}
+    parameters["Cin"]=Cin *1e12
+    parameters["Cfb"]=Cin/8 * 1e12
+    parameters["Ccm"]=Cin/8 * 1e12
+    parameters["Cload"]=Cin * 1e12
+    design = dict(Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
+
+    done = set()
+    if simulate and auto_stop:
+        # The transient length follows from the closed-loop time constant, so the AC run goes first
+        write_ac_closed(filename, **design, ctx=ctx)
+        _, tau_cl = read_ac_closed(filename, ctx=ctx, render=False)
+        parameters["T_stop"] = write_transient_auto(filename, tau_cl, ctx=ctx, **design) * 1e6
+        done = {"closed_loop_ac", "closed_loop_tran"}
+
+    if simulate and parallel_sims:
+        simulate_parallel(filename, design, parameters, parallel_sims=parallel_sims, ctx=ctx, render=render, done=done)
+    else:
+        for run_filename, write, kwargs, read in analyses(filename):
+            if simulate and run_filename not in done: write(filename, **design, **kwargs, ctx=ctx)
+            read(filename, parameters, ctx, render)
+
+    if adaptive_ac:
+        # Dense follow-up sweeps around the -3 dB, 0 dB and gain-margin points of
+        # the coarse AC runs, only read back when nothing is simulated
+        BW_cl, tau_cl = refine_ac_closed(filename, **design, simulate=simulate, ctx=ctx)
+        parameters["BW_cl"] = BW_cl * 1e-6
+        parameters["tau_cl"] = tau_cl
+        BW_ol, PM, GM, f_GM = refine_ac_open(filename, **design, load="loaded", simulate=simulate, ctx=ctx)
+        parameters["BW_ol"] = BW_ol * 1e-6
+        parameters["PM"] = PM
+        parameters["GM"] = GM
+        parameters["f_GM"] = f_GM
+
+    parameters["FOM_lin"], parameters["FOM_dB"] = figure_of_merit(parameters["P"], parameters["tau_cl_tran"], parameters["SNR"])
 
     return parameters
 
-def main(filename, Sa=3.5, R34=3, Rmp=5, Ibmain=200e-6, Cin=5e-12, Sa_b=1, simulate=True):
+def main(filename, Sa=3.5, R34=3, Rmp=5, Ibmain=200e-6, Cin=5e-12, Sa_b=1, simulate=True, parallel_sims=None, render_processes=None, adaptive_ac=False, auto_stop=False, trace_file=None):
     print(rf"SIMULATION === {simulate}")
-    parameters = evaluate_all(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, simulate=simulate)
+    figures = RenderQueue()
+    parameters = evaluate_all(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, simulate=simulate, parallel_sims=parallel_sims, render=figures, adaptive_ac=adaptive_ac, auto_stop=auto_stop)
+    figures.run(processes=render_processes)
     write_final_values("input_values.tex", Sa, R34, Rmp, Ibmain, Cin, Sa_b=Sa_b)
     write_table("result_table", parameters)
-    compileLatex(dir_path=os.path.dirname(dir_path), tex_name="HW2_Sjoerd_Terlouw")
 
     latex_path_old = os.path.join(os.path.dirname(dir_path), "HW2_Sjoerd_Terlouw.pdf")
     latex_path_new = os.path.join(os.path.dirname(dir_path), rf"Sa_{Sa}_R34_{R34}_Rmp_{Rmp}_Ibmain_{Ibmain*1e6}_Cin_{Cin*1e12}_Sab_{Sa_b}.pdf")
-    shutil.copy(latex_path_old, latex_path_new)
-
-def objective(params):
-        Ibmain, R34, Rmp, Sa_b, Sa, Cin = params
-        print(rf".param Ibmain = {Ibmain*1e6:.2f}u R34={R34:.2f} Rmp={Rmp:.2f} Sa_b={Sa_b:.2f} Sa={Sa:.2f} Cin={Cin*1e12:.3f}p")
-        print(rf"main(filename, Cin={Cin*1e12:.3f}e-12, Ibmain={Ibmain*1e6:.2f}e-6, R34={R34:.2f}, Rmp={Rmp:.2f}, Sa_b = {Sa_b:.2f}, Sa={Sa:.2f})")
-        
-        import time
-        temp_netlist = os.path.join(dir_path, "ML", f"temp_{int(time.time())}.net")
-
-        import shutil
-        shutil.copy2(os.path.join(dir_path, "Circuits", "ML.net"), temp_netlist)
-
-        # 1. Load the template
-        netlist = SpiceEditor(os.path.join(dir_path, "Circuits", temp_netlist))
-
-        # 2. Set parameters
-        netlist.set_parameters(Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-
-        # 3. Use a unique filename for the RUN
-        LTC.run(netlist, run_filename='ML')
-        LTC.wait_completion(timeout=5)
-
-        log = LTSpiceLogReader(os.path.join(dir_path, "Simulations", rf"ML.log"))
+    build_report(latex_path_new)
+    if os.path.isfile(latex_path_new):
+        shutil.copy(latex_path_new, latex_path_old)
+
+    if trace_file is not None:
+        export_chrome(trace_file)
+
+# Optimiser screening: a1 is measured by ML.asc t_a1 us after the input step.
+# Points whose surrogate a1 misses a1_target by more than screen_margin dB
+# are scored without running the transient.
+a1_target = 57.3
+t_a1 = 1.405
+screen_margin = 1
+
+def screen_point(params, ctx):
+    """
+    Predicts a1 from a rational fit of the closed-loop AC response. Returns the
+    a1 term of the fom, a lower bound of the full fom, for points that cannot
+    reach the target and None for points that need the full simulation.
+    """
+    Ibmain, R34, Rmp, Sa_b, Sa, Cin = params
+    write_ac_open(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, load="loaded", ctx=ctx)
+    f, A_CL = closed_loop_response(filename, load="loaded", ctx=ctx)
+    model, error = fit_closed_loop(f, A_CL)
+    a1 = surrogate_accuracy(model, t_a1)
+    print(rf"Surrogate a1 = {a1:.2f} (fit error {error:.1e})")
+    if a1 >= a1_target - screen_margin:
+        return None
+    return 0.1*np.abs((a1-a1_target)*10000)**2
+
+def log_point(params, fom, values=None, duration=None, status="ok", traces=None, spans=None):
+    record(params, fom, values, duration=duration, status=status, traces=traces, stages=None if spans is None else summary(spans))
+
+def timed(function, *args, **kwargs):
+    # Result, wall time and the spans of the call
+    with recording() as spans:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+    return result, time.perf_counter() - start, spans
+
+def evaluate_corner(filename, design, corner, parallel_sims=3):
+    # Runs in a pool worker, its spans are merged into the parent's trace
+    with RunContext(name=corner_name(corner), corner=corner) as ctx:
+        parameters, duration, spans = timed(evaluate_all, filename, **design, simulate=True, parallel_sims=parallel_sims, ctx=ctx, render=False)
+    return corner, parameters, spans
+
+def corner_sweep(filename, design, corners=None, processes=4, parallel_sims=3, ctx=None):
+    """
+    Evaluates a design at every PVT corner (corners.corner_matrix by default):
+    corners run in a process pool, each in its own run context, and the
+    analyses of one corner share a runner. Returns the tidy table and the
+    worst case of every metric, both also written to the processing folder.
+    """
+    ctx = ctx or default_context
+    corners = corners or corner_matrix()
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(evaluate_corner, filename, design, corner, parallel_sims): corner for corner in corners}
+        for future in as_completed(futures):
+            try:
+                corner, parameters, spans = future.result()
+            except Exception as e:
+                print(rf"CORNER {corner_name(futures[future])} FAILED: {e}")
+                continue
+            merge(spans)
+            print(rf"Corner {corner_name(corner)}: FOM_dB = {parameters['FOM_dB']:.2f}")
+            results.append((corner, parameters))
+
+    results.sort(key=lambda result: corners.index(result[0]))
+    table = tidy(results)
+    worst = worst_case(table)
+    table.to_csv(ctx.processing(rf"{filename}_corners.csv"), index=False)
+    worst.to_csv(ctx.processing(rf"{filename}_corners_worst.csv"), index=False)
+    print(worst)
+    return table, worst
+
+def evaluate_design(filename, design, parallel_sims=3):
+    # Runs in a pool worker, its spans are merged into the parent's trace
+    with RunContext(name="doe") as ctx:
+        parameters, duration, spans = timed(evaluate_all, filename, **design, simulate=True, parallel_sims=parallel_sims, ctx=ctx, render=False)
+    return parameters, duration, spans
+
+def doe_batch(filename, points, out_csv=None, processes=4, parallel_sims=3, retry_failed=False, ctx=None):
+    """
+    Runs a design of experiments (see Code/doe.py for the design sources)
+    through evaluate_all: points run in a process pool, each in its own run
+    context, and every finished point is appended to one results table.
+    Points already in the table are skipped, so a crashed batch is resumed by
+    running it again. Returns the path of the table.
+    """
+    ctx = ctx or default_context
+    out_csv = out_csv or ctx.processing(rf"{filename}_doe.csv")
+    todo = pending_points(points, out_csv, retry_failed=retry_failed)
+    print(rf"DoE: {len(points)} points, {len(todo)} to evaluate")
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(evaluate_design, filename, design, parallel_sims): design for design in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            design = futures[future]
+            try:
+                parameters, duration, spans = future.result()
+            except Exception as e:
+                print(rf"DESIGN {design} FAILED: {e}")
+                append_result(out_csv, {**design, "status": "failed"})
+                continue
+            merge(spans)
+            print(rf"DoE {n}/{len(todo)}: FOM_dB = {parameters['FOM_dB']:.2f}")
+            # The design values in SI units take precedence over evaluate_all's Cin in pF
+            append_result(out_csv, {**design, "status": "ok", "duration": duration, **{k: v for k, v in parameters.items() if k not in design}})
+    return out_csv
+
+def simulate_point(params, ctx, timeout=5, screen=False):
+    """
+    Runs the ML.asc transient and the noise simulation of one design point in
+    its own run context, so several points can be simulated at once. With
+    screen, returns the screening fom instead for points screen_point rejects.
+    """
+    Ibmain, R34, Rmp, Sa_b, Sa, Cin = params
+    if screen:
         try:
-            a0 = log.get_measure_value("a0")
-            a1 = log.get_measure_value("a1")
-            cur = log.get_measure_value("current")
-            write_onoise(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
-            SNR, _ = read_onoise(filename)
-
-            fom = 0.1*np.abs((a1-57.3)*10000)**2 + 10*np.abs(cur) + 0.1*np.abs((SNR-83.65)*10000)**2
-
-            print(a0, a1, cur, SNR)
+            fom = screen_point(params, ctx)
+        except Exception as e:
+            # Fall back to the full simulation
+            print(rf"SCREENING FAILED: {e}")
+            fom = None
+        if fom is not None:
+            print("Rejected by the surrogate")
+            return fom
+    LTC = get_runner(ctx.sim_dir, parallel_sims=2)
+
+    netlist = load_netlist(ctx.circuit("ML.asc"), LTC, corner=ctx.corner)
+    netlist.set_parameters(Sa=Sa, Rmp=Rmp, R34=R34, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b)
+    run_cached(LTC, netlist, "ML")
+    write_onoise(filename, Sa=Sa, R34=R34, Rmp=Rmp, Ibmain=Ibmain, Cin=Cin, Sa_b=Sa_b, LTC=LTC, ctx=ctx)
+
+    with span("ML", "simulate"):
+        LTC.wait_completion(timeout=timeout)
+
+def score_point(params, ctx):
+    """
+    Reads the ML.asc measurements and the noise of a simulated point.
+    Returns (fom, metrics, status).
+    """
+    Ibmain, R34, Rmp, Sa_b, Sa, Cin = params
+    print(rf".param Ibmain = {Ibmain*1e6:.2f}u R34={R34:.2f} Rmp={Rmp:.2f} Sa_b={Sa_b:.2f} Sa={Sa:.2f} Cin={Cin*1e12:.3f}p")
+    print(rf"main(filename, Cin={Cin*1e12:.3f}e-12, Ibmain={Ibmain*1e6:.2f}e-6, R34={R34:.2f}, Rmp={Rmp:.2f}, Sa_b = {Sa_b:.2f}, Sa={Sa:.2f})")
+
+    try:
+        from PyLTSpice import LTSpiceLogReader
+        with span("read_ML_log", "read"):
+            log = LTSpiceLogReader(ctx.sim("ML.log"))
+        a0 = log.get_measure_value("a0")
+        a1 = log.get_measure_value("a1")
+        cur = log.get_measure_value("current")
+        SNR, _ = read_onoise(filename, ctx=ctx, render=False)
+
+        fom = 0.1*np.abs((a1-57.3)*10000)**2 + 10*np.abs(cur) + 0.1*np.abs((SNR-83.65)*10000)**2
+        values = {"a0": a0, "a1": a1, "current": cur, "SNR": SNR}
+        status = "ok"
+
+        print(a0, a1, cur, SNR)
+    except:
+        fom = 1e30
+        values = {}
+        status = "failed"
+        print("SIMULATION FAILED")
+        try:
+            os.system("taskkill /f /im XVIIx64.exe /t")
         except:
-            fom = 1e30
-            print("SIMULATION FAILED")
-            try:
-                os.system("taskkill /f /im XVIIx64.exe /t")
-            except:
-                1==1
-
-        with open(os.path.join(dir_path, "optimization_log.csv"),"a") as f:
-            # Format: Time, Ibmain, R34, Rmp, Sa_b, Sa, FoM
-            f.write(f"{time.ctime()}, {','.join(map(str, params))}, {fom}\n")
+            1==1
+
+    return fom, values, status
+
+def objective(params, screen=False, archive=False):
+    """
+    fom of one design point. Points already in the evaluation store are not
+    simulated again; with archive the run directory is kept as a zip and
+    referenced from the store.
+    """
+    fom = lookup(params)
+    if fom is not None:
+        print("Already evaluated")
         return fom
 
-def ML(load_old=False):
-    params = spice_to_dict(".param Cin=61p Ibmain=2000u R34=2 Rmp=4 Sa_b=4000 Sa=92.5")
-
-    space = [
-        Real(565.25e-6, 575e-6), # Ibmain
-        Real(90, 100),                       # R34
-        Real(0.5, 2),                       # Rmp
-        Real(15, 19),  # Sa_b
-        Real(0.8, 1.15),  # Sa
-        Real(25e-12, 35e-12), # Cin
-    ]
-
-    checkpoint_callback = CheckpointSaver(os.path.join(dir_path, "result.pkl"), compress=4)
-
-    if load_old:
-        print("Found existing checkpoint")
-        res_prev = load(os.path.join(dir_path, "result.pkl"))
-        x0 = res_prev.x_iters
-        y0 = res_prev.func_vals
+    ctx = RunContext(name="ML", cleanup="archive" if archive else "delete")
+    with ctx:
+        fom, duration, spans = timed(simulate_point, params, ctx, screen=screen)
+        if fom is not None:
+            values, status = {}, "screened"
+        else:
+            (fom, values, status), scoring, more = timed(score_point, params, ctx)
+            duration += scoring
+            spans += more
+    log_point(params, fom, values, duration=duration, status=status, traces=ctx.archive_file if archive else None, spans=spans)
+    return fom
+
+def evaluate_batch(points, n_jobs=4, screen=False, archive=False):
+    """
+    Simulates a batch of design points concurrently, each in an isolated run
+    directory, and scores them in the calling thread as they finish. Points
+    already in the evaluation store are not simulated again.
+    """
+    foms = [lookup(params) for params in points]
+    contexts = {i: RunContext(name="ML", cleanup="archive" if archive else "delete") for i, fom in enumerate(foms) if fom is None}
+    finished = []
+    try:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            futures = {pool.submit(timed, simulate_point, points[i], ctx, screen=screen): i for i, ctx in contexts.items()}
+            for future in as_completed(futures):
+                i = futures[future]
+                fom, duration, spans = future.result()
+                if fom is not None:
+                    values, status = {}, "screened"
+                else:
+                    (fom, values, status), scoring, more = timed(score_point, points[i], contexts[i])
+                    duration += scoring
+                    spans += more
+                foms[i] = fom
+                finished.append((i, values, duration, status, spans))
+    finally:
+        for ctx in contexts.values():
+            ctx.close()
+    # Logged once the run directories are archived
+    for i, values, duration, status, spans in finished:
+        log_point(points[i], foms[i], values, duration=duration, status=status, traces=contexts[i].archive_file if archive else None, spans=spans)
+    return foms
+
+def ML_batch(space, x0, y0, n_calls, n_random, batch_size=4, n_jobs=4, callback=None, screen=False, archive=False):
+    """
+    Bayesian optimisation through the skopt ask/tell interface: every round asks
+    batch_size points with the constant-liar strategy and evaluates them at once.
+    """
+    from skopt import Optimizer
+    opt = Optimizer(space, base_estimator="GP", n_initial_points=n_random, acq_func="gp_hedge")
+
+    # As in gp_minimize, n_calls counts new evaluations: x0 only counts when it
+    # is evaluated here, not when its foms come with it (a warm start)
+    x0 = [list(x) for x in x0] if np.ndim(x0) == 2 else [list(x0)]
+    evaluated = 0
+    if y0 is None:
+        y0 = evaluate_batch(x0, n_jobs=n_jobs, screen=screen, archive=archive)
+        evaluated = len(x0)
+    res = opt.tell(x0, list(y0))
+
+    while evaluated < n_calls:
+        n_points = min(batch_size, n_calls - evaluated)
+        points = opt.ask(n_points=n_points, strategy="cl_min")
+        res = opt.tell(points, evaluate_batch(points, n_jobs=n_jobs, screen=screen, archive=archive))
+        evaluated += n_points
+        print(rf"Evaluated {evaluated}/{n_calls}, best fom {res.fun}")
+        if callback is not None:
+            callback(res)
+    return res
+
+def ML(load_old=False, batch_size=1, n_jobs=4, screen=False, archive=False, warm_start=None, trace_file=None):
+    from skopt import gp_minimize
+    from skopt.space import Real
+
+    # Ibmain, R34, Rmp, Sa_b, Sa, Cin
+    space = [Real(*design_space[name]) for name in ml_parameters]
+
+    # Warm start from the best warm_start (all when None) stored evaluations
+    x0, y0 = history(limit=warm_start) if load_old else ([], [])
+    if x0:
+        print(rf"Warm start from {len(x0)} stored evaluations")
         n_random = 40
     else:
-        print("No checkpoint found")
+        print("No stored evaluations")
         x0 = (572.25e-6, 95, 0.9, 17, 0.985, 32.18e-12)
         y0 = None
         n_random = 20
 
     # --- THE OPTIMIZER ---
-    res = gp_minimize(
-        objective, 
-        space,
-        x0=x0,
-        y0=y0,
-        n_calls=2000,
-        n_random_starts=n_random,
-        callback=[checkpoint_callback],
-        verbose=True
-    )
+    if batch_size > 1:
+        res = ML_batch(space, x0, y0, n_calls=2000, n_random=n_random, batch_size=batch_size, n_jobs=n_jobs, screen=screen, archive=archive)
+    else:
+        res = gp_minimize(
+            partial(objective, screen=screen, archive=archive), 
+            space,
+            x0=x0,
+            y0=y0,
+            n_calls=2000,
+            n_random_starts=n_random,
+            verbose=True
+        )
+
+    if trace_file is not None:
+        export_chrome(trace_file)
 
     Ibmain, R34, Rmp, Sa_b, Sa, Cin = res.x
     Ibmain, R34, Rmp, Sa_b, Sa, Cin = np.round((R34, Rmp, Sa_b, Sa, Ibmain*1e6, Cin*1e12),2)
@@ -223,30 +504,6 @@ def ML(load_old=False):
     plot_convergence(res)
     plt.show()
 
-def spice_to_dict(param_str):
-    # Dictionary of Spice multipliers
-    multipliers = {
-        't': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3, 
-        'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15
-    }
-    
-    # Extract key=value pairs using Regex
-    # Matches patterns like Ibmain=28.05u
-    matches = re.findall(r'(\w+)=([\d\.]+)([a-zA-Z]*)', param_str)
-    
-    results = {}
-    for key, val, unit in matches:
-        value = float(val)
-        unit = unit.lower()
-        
-        # Apply multiplier if it exists
-        if unit in multipliers:
-            value *= multipliers[unit]
-            
-        results[key] = value
-    print(results)
-    return results
-
 # params = spice_to_dict(".param Cin=29.5p Ibmain=572.25u Rmp=0.9 Sa=0.917 Sa_b=17 R34=95")
 # write_operating_point(filename, Sa=params["Sa"], Rmp=params["Rmp"], R34=params["R34"], Ibmain=params["Ibmain"], Cin=params["Cin"], Sa_b=params["Sa_b"])
 # read_operating_point(filename, save=True)
@@ -291,7 +548,96 @@ def spice_to_dict(param_str):
 # main(filename, Sa=params["Sa"], Rmp=params["Rmp"], R34=params["R34"], Ibmain=params["Ibmain"], Cin=params["Cin"], Sa_b=params["Sa_b"])
 
 # REQUIREMENTS+ALMOSTSAT+175.333
-params = spice_to_dict(".param Cin=32.36p Ibmain=572.1u Rmp=0.907 Sa=0.986 Sa_b=16.907 R34=95")
-main(filename, Sa=params["Sa"], Rmp=params["Rmp"], R34=params["R34"], Ibmain=params["Ibmain"], Cin=params["Cin"], Sa_b=params["Sa_b"])
+default_design = ".param Cin=32.36p Ibmain=572.1u Rmp=0.907 Sa=0.986 Sa_b=16.907 R34=95"
+
+def cli(argv=None):
+    """
+    Command line entry point, e.g.
+
+        python main.py evaluate --params ".param Cin=32.36p Ibmain=572.1u Rmp=0.907 Sa=0.986 Sa_b=16.907 R34=95"
+        python main.py optimise --batch-size 4 --screen
+        python main.py report --force
+        python main.py sweep points.csv
+        python main.py doe --lhs 20
+
+    Without a command the default design is evaluated.
+    """
+    parser = argparse.ArgumentParser(description="Simulation, optimisation and report flow of the HW2 amplifier")
+    commands = parser.add_subparsers(dest="command")
+
+    evaluate = commands.add_parser("evaluate", help="simulate one design point and build its report")
+    evaluate.add_argument("--params", default=default_design, help="design point as an LTspice .param line")
+    evaluate.add_argument("--no-simulate", action="store_true", help="only read the results of earlier simulations")
+    evaluate.add_argument("--parallel-sims", type=int)
+    evaluate.add_argument("--render-processes", type=int)
+    evaluate.add_argument("--adaptive-ac", action="store_true")
+    evaluate.add_argument("--auto-stop", action="store_true")
+    evaluate.add_argument("--trace", help="write a Chrome trace of the run to this file")
+
+    optimise = commands.add_parser("optimise", help="Bayesian optimisation of the ML.asc figure of merit")
+    optimise.add_argument("--load-old", action="store_true", help="warm-start from the evaluation store")
+    optimise.add_argument("--warm-start", type=int, help="only warm-start from this many best evaluations")
+    optimise.add_argument("--batch-size", type=int, default=1)
+    optimise.add_argument("--n-jobs", type=int, default=4)
+    optimise.add_argument("--screen", action="store_true", help="reject points with the AC surrogate first")
+    optimise.add_argument("--archive", action="store_true", help="keep the run directories as zip files")
+    optimise.add_argument("--trace", help="write a Chrome trace of the run to this file")
+
+    report = commands.add_parser("report", help="build the report from the current figures and tables")
+    report.add_argument("--out", default=os.path.join(os.path.dirname(dir_path), "HW2_Sjoerd_Terlouw.pdf"))
+    report.add_argument("--force", action="store_true", help="compile even when no input changed")
+
+    sweep = commands.add_parser("sweep", help="evaluate the design points of a CSV file with stepped simulations")
+    sweep.add_argument("points", help=rf"CSV with a header row and the columns {', '.join(sweep_parameters)}")
+    sweep.add_argument("--out", help="results CSV, by default in the processing folder")
+    sweep.add_argument("--parallel-sims", type=int, default=3)
+
+    doe = commands.add_parser("doe", help="evaluate a design of experiments into one resumable results table")
+    source = doe.add_mutually_exclusive_group(required=True)
+    source.add_argument("--param-file", help="file of .param lines, one design point per line")
+    source.add_argument("--csv", help=rf"CSV with a header row and the columns {', '.join(sweep_parameters)}")
+    source.add_argument("--lhs", type=int, metavar="N", help="N point Latin hypercube over the optimiser's design space")
+    source.add_argument("--factorial", type=int, metavar="LEVELS", help="full factorial with LEVELS values per parameter")
+    doe.add_argument("--seed", type=int, default=0, help="seed of the Latin hypercube")
+    doe.add_argument("--out", help="results CSV, by default in the processing folder")
+    doe.add_argument("--processes", type=int, default=4)
+    doe.add_argument("--parallel-sims", type=int, default=3)
+    doe.add_argument("--retry-failed", action="store_true", help="evaluate failed points of the results table again")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["evaluate"])
+
+    if args.command == "evaluate":
+        params = spice_to_dict(args.params)
+        main(filename, Sa=params["Sa"], Rmp=params["Rmp"], R34=params["R34"], Ibmain=params["Ibmain"], Cin=params["Cin"], Sa_b=params["Sa_b"],
+             simulate=not args.no_simulate, parallel_sims=args.parallel_sims, render_processes=args.render_processes,
+             adaptive_ac=args.adaptive_ac, auto_stop=args.auto_stop, trace_file=args.trace)
+    elif args.command == "optimise":
+        ML(load_old=args.load_old, batch_size=args.batch_size, n_jobs=args.n_jobs, screen=args.screen, archive=args.archive,
+           warm_start=args.warm_start, trace_file=args.trace)
+    elif args.command == "report":
+        build_report(args.out, force=args.force)
+    elif args.command == "sweep":
+        data = np.genfromtxt(args.points, delimiter=",", names=True)
+        results = evaluate_sweep(filename, {name: data[name] for name in sweep_parameters}, parallel_sims=args.parallel_sims)
+        n = len(np.atleast_1d(data))
+        out = args.out or default_context.processing(rf"{filename}_sweep.csv")
+        np.savetxt(out, np.column_stack([np.broadcast_to(values, n) for values in results.values()]), delimiter=",", header=",".join(results), comments="")
+        print(rf"Results written to {out}")
+    elif args.command == "doe":
+        if args.param_file:
+            points = read_param_file(args.param_file)
+        elif args.csv:
+            points = read_csv(args.csv)
+        elif args.lhs:
+            points = latin_hypercube(args.lhs, seed=args.seed)
+        else:
+            points = full_factorial(args.factorial)
+        out = doe_batch(filename, points, out_csv=args.out, processes=args.processes, parallel_sims=args.parallel_sims, retry_failed=args.retry_failed)
+        print(rf"Results written to {out}")
+
+if __name__ == "__main__":
+    cli()
 
 # .param Cin=48.4p*(1-0.32*{x}**0.43) Rmp=0.67 Sa=13 Sa_b=20.20 R34=89.14*{x} Ibmain=572.25u*{x}
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py and the Code package live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
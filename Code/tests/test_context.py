@@ -0,0 +1,11 @@
+import os
+
+from Code.context import RunContext
+
+def test_output_dirs_are_created_on_first_use(tmp_path):
+    ctx = RunContext(root=str(tmp_path), cleanup="keep")
+    assert os.listdir(tmp_path) == []
+
+    path = ctx.sim("amp.net")
+    assert path == os.path.join(str(tmp_path), "Simulations", "amp.net")
+    assert os.listdir(tmp_path) == ["Simulations"]
@@ -0,0 +1,81 @@
+import os
+import pytest
+
+from Code.netlist import _convert, _digest, _stamp_file, apply_corner
+from Code.corners import Corner
+from Code.simulator import NgspiceRunner
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+def test_ngspice_uses_existing_netlist(tmp_path):
+    asc_file = str(tmp_path / "amp.asc")
+    net_file = str(tmp_path / "amp.net")
+    write(asc_file, "Version 4\n")
+    write(net_file, "* amp\nR1 a 0 1k\n.op\n.end\n")
+
+    runner = NgspiceRunner(output_folder=str(tmp_path))
+    with pytest.warns(UserWarning, match="amp.net"):
+        assert _convert(asc_file, _digest(asc_file), runner) == net_file
+    assert not os.path.isfile(_stamp_file(asc_file))
+
+def test_stamped_netlist_is_reused_quietly(tmp_path, recwarn):
+    asc_file = str(tmp_path / "amp.asc")
+    net_file = str(tmp_path / "amp.net")
+    write(asc_file, "Version 4\n")
+    write(net_file, "* amp\n.end\n")
+    write(_stamp_file(asc_file), _digest(asc_file))
+
+    runner = NgspiceRunner(output_folder=str(tmp_path))
+    assert _convert(asc_file, _digest(asc_file), runner) == net_file
+    assert not recwarn.list
+
+class Primitive:
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __str__(self):
+        return self._obj
+
+class Circuit:
+    # The parts of SpiceEditor apply_corner uses
+    def __init__(self, netlist):
+        self.netlist = netlist
+        self.values = {}
+
+    def get_components(self, prefix):
+        return [str(line).split()[0] for line in self.netlist if str(line).startswith(prefix)]
+
+    def set_component_value(self, ref, value):
+        self.values[ref] = value
+
+    def add_instruction(self, instruction):
+        self.netlist.append(instruction + "\n")
+
+    def text(self):
+        return "".join(line.text() if isinstance(line, Circuit) else str(line) for line in self.netlist)
+
+def test_apply_corner_rewrites_every_lib_line():
+    lib = ".lib 'C:\\lib\\cmp\\log018.l' TT\n"
+    subcircuit = Circuit([".subckt amp in out\n", Primitive(lib), ".ends amp\n"])
+    netlist = Circuit(["* amp\n", "Vdd vdd 0 1.8\n", Primitive(lib), lib, subcircuit, ".end\n"])
+
+    apply_corner(netlist, Corner("FF", 1.98, 125))
+    text = netlist.text()
+    assert text.count("log018.l' FF\n") == 3
+    assert " TT" not in text
+    assert netlist.values == {"Vdd": "1.98"}
+    assert ".temp 125\n" in text
+
+def test_apply_corner_on_spice_editor(tmp_path):
+    PyLTSpice = pytest.importorskip("PyLTSpice")
+    from Code.cache import netlist_text, decode_netlist
+    net_file = str(tmp_path / "amp.net")
+    write(net_file, "* amp\nVdd vdd 0 1.8\nX1 vdd 0 amp\n.subckt amp a b\n.lib 'log018.l' TT\nR1 a b 1k\n.ends amp\n.lib 'log018.l' TT\n.op\n.end\n")
+
+    netlist = PyLTSpice.SpiceEditor(net_file)
+    apply_corner(netlist, Corner("SS", 1.62, -40))
+    text = decode_netlist(netlist_text(netlist))
+    assert text.count(".lib 'log018.l' SS") == 2
+    assert " TT" not in text
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from Code.context import RunContext
+from Code import operating_point
+from Code.operating_point import parse_op_log, op_table, read_operating_point
+
+# Trimmed LTspice log: a MOSFET block split over two name rows, and a block of
+# another device type with its own quantities
+op_log = """Circuit: * closed_loop.asc
+
+Direct Newton iteration for .op point succeeded.
+
+Semiconductor Device Operating Points:
+                        --- BSIM3 MOSFETS ---
+Name:         m:x1:n1       m:x1:p1
+Model:       x1:nch.9      x1:pch.9
+Id:          6.59e-05     -3.30e-05
+Vgs:         6.33e-01     -8.17e-01
+Vds:         1.43e-01     -4.43e-01
+Vth:         5.26e-01     -4.94e-01
+
+Name:         m:x1:n3
+Model:       x1:nch.9
+Id:          3.30e-05
+Vgs:         4.93e-01
+Vds:         9.50e-01
+Vth:         6.30e-01
+
+                        --- Diodes ---
+Name:         d:x1:1
+Model:          dmod
+Id:          1.00e-09
+Vd:          3.00e-01
+
+Date: Sat Feb 14 12:00:00 2026
+Total elapsed time: 0.1 seconds.
+"""
+
+@pytest.fixture
+def ctx(tmp_path):
+    ctx = RunContext(root=str(tmp_path), cleanup="keep")
+    with open(ctx.sim("closed_loop_op.log"), "w", encoding="utf-16-le") as f:
+        f.write(op_log)
+    operating_point.clear()
+    return ctx
+
+def test_parse_structured_table(ctx):
+    table = parse_op_log(ctx.sim("closed_loop_op.log"))
+    assert list(table["name"]) == ["m:x1:n1", "m:x1:p1", "m:x1:n3", "d:x1:1"]
+    assert table.dtype.names == ("name", "Model", "Id", "Vgs", "Vds", "Vth", "Vd")
+    assert list(table["Model"]) == ["x1:nch.9", "x1:pch.9", "x1:nch.9", "dmod"]
+    assert table["Id"] == pytest.approx([6.59e-05, -3.30e-05, 3.30e-05, 1e-09])
+    # Quantities a device type does not report are nan
+    assert np.isnan(table["Vgs"][3]) and np.isnan(table["Vd"][0])
+    assert not table.flags.writeable
+
+def test_latin1_log(tmp_path):
+    path = tmp_path / "op.log"
+    path.write_text(op_log, encoding="latin-1")
+    assert len(parse_op_log(path)) == 4
+
+def test_missing_section(tmp_path):
+    path = tmp_path / "op.log"
+    path.write_text("Circuit: * closed_loop.asc\n", encoding="latin-1")
+    with pytest.raises(ValueError):
+        parse_op_log(path)
+
+def test_table_is_memoised_on_mtime(ctx):
+    table = op_table("closed_loop", ctx=ctx)
+    assert op_table("closed_loop", ctx=ctx) is table
+
+    path = ctx.sim("closed_loop_op.log")
+    with open(path, "w", encoding="utf-16-le") as f:
+        f.write(op_log.replace("6.59e-05", "7.00e-05"))
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    assert op_table("closed_loop", ctx=ctx)["Id"][0] == pytest.approx(7e-05)
+
+def test_read_operating_point_returns_table_and_check(ctx):
+    table, check = read_operating_point("closed_loop", save=False, ctx=ctx)
+    assert table is op_table("closed_loop", ctx=ctx)
+    assert check["Vgs"][:3] == pytest.approx([0.633, 0.817, 0.493])
+    assert check["Vds_Vth"][:3] == pytest.approx([0.669, 0.937, 1.58])
+    assert list(check["saturated"][:3]) == [True, True, False]
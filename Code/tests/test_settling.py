@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from Code.transient import settling_crossings, settling_metrics, t_offset
+
+def ringing(t):
+    # Decaying, ringing virtual-ground error after the input step at t_offset
+    s = np.clip(t - t_offset, 0, None)
+    e = np.where(t < t_offset, 0, 0.6*np.exp(-s/0.5)*np.cos(2*np.pi*s/0.7))
+    return 20*np.log10(1.2/(np.abs(e) + 1e-9))
+
+def test_exponential_crossings_are_exact():
+    # A single pole gives an accuracy linear in t, both interpolations are exact on it
+    t = np.arange(0, 10, 0.05)
+    accuracy = 19.3 + 20/np.log(10) * np.clip(t - t_offset, 0, None) / 0.1
+    exact = t_offset + (np.array([48.69, 40, 57]) - 19.3) * 0.1 * np.log(10)/20
+    for kind in ("linear", "cubic"):
+        assert settling_crossings(t, accuracy, (48.69, 40, 57), kind=kind) == pytest.approx(exact, rel=1e-9)
+
+def test_coarse_step_matches_fine_step():
+    # tran_max_step went from 5 ns to 50 ns, on this response the cubic
+    # crossings keep tau_cl_tran within 0.3 % (faster ringing needs a finer step)
+    t_fine = np.arange(0, 30, 0.005)
+    t_coarse = np.arange(0, 30, 0.05)
+    fine = settling_metrics(t_fine, ringing(t_fine), kind="cubic")
+    coarse = settling_metrics(t_coarse, ringing(t_coarse), kind="cubic")
+    assert coarse["tau_cl_tran"] == pytest.approx(fine["tau_cl_tran"], rel=3e-3)
+    assert coarse["T_settle"] == pytest.approx(fine["T_settle"], rel=1e-3)
+
+def test_final_crossing_after_ringing():
+    # The ringing dips back below the levels, the last upward crossing counts
+    t = np.arange(0, 20, 0.005)
+    accuracy = ringing(t)
+    T_settle = settling_metrics(t, accuracy)["T_settle"] + t_offset
+    assert np.all(accuracy[t > T_settle + 0.005] >= 57)
+    assert np.any(accuracy[t < T_settle - 0.005][t[t < T_settle - 0.005] > t_offset] >= 57)
+
+def test_rows_and_unsettled_traces():
+    t = np.arange(0, 20, 0.05)
+    rows = np.stack([ringing(t), ringing(t*1.1), np.full_like(t, 30.0), np.full_like(t, 80.0)])
+    metrics = settling_metrics(t, rows)
+    assert metrics["T_settle"][0] == pytest.approx(settling_metrics(t, rows[0])["T_settle"])
+    # Never settled: the last time point, always settled: the first
+    assert metrics["T_settle"][2] == pytest.approx(t[-1] - t_offset)
+    assert metrics["T_settle"][3] == pytest.approx(t[0] - t_offset)
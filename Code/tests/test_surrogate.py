@@ -0,0 +1,33 @@
+import numpy as np
+
+from Code.surrogate import vector_fit, evaluate
+
+def test_vector_fit_recovers_poles():
+    # Real pole, complex pair and a pole-zero doublet (small residue at 2 MHz)
+    poles = np.array([-2*np.pi*1e5, -2*np.pi*(3e7 + 2e7j), -2*np.pi*(3e7 - 2e7j), -2*np.pi*2e6])
+    residues = np.array([2*np.pi*2e5, 1e7*(1 + 1j), 1e7*(1 - 1j), 1e3])
+    f = np.logspace(3, 10, 200)
+    H = evaluate((poles, residues, 0.0), f)
+
+    fitted, _, _ = vector_fit(f, H, n_poles=4, n_iter=20)
+    for pole in poles:
+        assert np.min(np.abs(fitted - pole)) / np.abs(pole) < 1e-10
+
+def single_pole(f_p):
+    f = np.logspace(3, 10, 200)
+    return f, -1/(1 + 1j*f/f_p)
+
+def screen(monkeypatch, f_p):
+    import main
+    monkeypatch.setattr(main, "write_ac_open", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, "closed_loop_response", lambda *args, **kwargs: single_pole(f_p))
+    return main.screen_point([570e-6, 95, 1, 17, 1, 30e-12], ctx=None)
+
+def test_fast_point_is_simulated(monkeypatch):
+    # Settles far past the target within t_a1
+    assert screen(monkeypatch, 50e6) is None
+
+def test_slow_point_is_screened_out(monkeypatch):
+    # Settles to only a few dB more than A_initial within t_a1
+    fom = screen(monkeypatch, 100e3)
+    assert fom is not None and fom > 0
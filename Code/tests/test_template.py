@@ -0,0 +1,44 @@
+import re
+import shutil
+
+import pytest
+
+from Code.context import RunContext
+from Code.template import render
+
+# Placeholders of the voltage schematic, as filled in by annotate_voltages
+voltage_names = ["Vbp", "Vsp", "Vcp", "Vcn", "Vsn", "Vbn", "Vdd", "Vi+", "Vi-", "Vo-", "Vo+", "Vgn2", "Vsi", "Vssi", "Vbcm", "Vpml", "Vpmr", "Vpg", "Vnml", "Vnmr"]
+
+def substitute(template_file, out, values, placeholder):
+    # The copy and re.sub loop the renderer replaced
+    shutil.copy(template_file, out)
+    with open(out, "r+") as f:
+        file_data = f.read()
+        for name, value in values.items():
+            file_data = re.sub(re.escape(placeholder.format(name)), value, file_data)
+        f.seek(0)
+        f.write(file_data)
+        f.truncate()
+
+@pytest.mark.parametrize("template, placeholder, names", [
+    ("result_table_template.tex", "__{}__", None),
+    ("op_amp_voltage_template.svg", "{}_V", voltage_names),
+])
+def test_render_matches_substitution(tmp_path, template, placeholder, names):
+    template_file = RunContext(root=str(tmp_path), cleanup="keep").template(template)
+    if names is None:
+        with open(template_file) as f:
+            names = sorted(set(re.findall(r"__(\w+?)__", f.read())))
+    values = {name: rf"{i * 1.2345:.3f}" for i, name in enumerate(names)}
+
+    substitute(template_file, tmp_path / "expected", values, placeholder)
+    render(template_file, values, placeholder=placeholder, out=tmp_path / "rendered")
+    assert (tmp_path / "rendered").read_bytes() == (tmp_path / "expected").read_bytes()
+
+def test_render_recompiles_changed_template(tmp_path):
+    template_file = tmp_path / "table_template.tex"
+    template_file.write_text("a = __a__, ab = __ab__\n")
+    assert render(template_file, {"a": "1", "ab": "2"}, placeholder="__{}__") == "a = 1, ab = 2\n"
+
+    template_file.write_text("ab = __ab__ only\n")
+    assert render(template_file, {"a": "1", "ab": "2"}, placeholder="__{}__") == "ab = 2 only\n"